@@ -7,28 +7,54 @@ Enhanced with HuggingFace sketch colorization
 
 import os
 import json
+import asyncio
+import concurrent.futures
 import math
 import base64
+import gzip
+import hashlib
+import importlib.util
 import tempfile
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
 from typing import Dict, List, Optional, Tuple, Any
 from io import BytesIO
 
 # Core dependencies
 import numpy as np
 from PIL import Image, ImageEnhance, ImageFilter
+import httpx
 import uvicorn
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
+try:
+    import anthropic
+except ImportError:
+    anthropic = None
+
+# orjson encodes and parses several times faster than stdlib json; its decode
+# errors subclass json.JSONDecodeError, so existing handlers still apply
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+    DefaultJSONResponse = ORJSONResponse
+except ImportError:
+    json_loads = json.loads
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+    DefaultJSONResponse = JSONResponse
+
 # Load environment
 load_dotenv()
 
 # Initialize FastAPI
-app = FastAPI(title="Pantone Vision 2.0", version="2.0.0")
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app = FastAPI(title="Pantone Vision 2.0", version="2.0.0", default_response_class=DefaultJSONResponse)
 
 # Import texture service
 from services.texture_application_service import TextureApplicationService
@@ -37,81 +63,76 @@ from services.texture_application_service import TextureApplicationService
 API_KEY = os.getenv('ANTHROPIC_API_KEY')
 HF_API_KEY = os.getenv('HUGGINGFACE_API_KEY')
 MAX_FILE_SIZE = 15 * 1024 * 1024  # 15MB
+MAX_REQUEST_SIZE = 2 * MAX_FILE_SIZE + 1024 * 1024  # two uploads plus form fields
 
 # Create directories
 os.makedirs('uploads', exist_ok=True)
 os.makedirs('results', exist_ok=True)
 
-class UniversalColorMatcher:
-    """
-    *** ORIGINAL UNIVERSAL COLOR MATCHING LOGIC - PRESERVED EXACTLY ***
-    Universal color matching system that can identify ANY color
-    Uses AI + comprehensive color science instead of hardcoded database
-    """
+# sRGB (D65) -> XYZ matrix with the D65 white point divided out of each row,
+# so the normalisation rides along with the matmul
+_D65_WHITE = np.array([0.95047, 1.00000, 1.08883])
+_SRGB_TO_XYZ_D65 = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+]) / _D65_WHITE[:, None]
+
+def rgb_to_lab_array(rgb) -> np.ndarray:
+    """Vectorized sRGB -> CIELAB for an (..., 3) array of 0-255 values (or a single triple)"""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
     
-    def __init__(self):
-        load_dotenv()
-        self.api_key = os.getenv('ANTHROPIC_API_KEY')
-        
-    def rgb_to_lab(self, rgb: Tuple[int, int, int]) -> Tuple[float, float, float]:
-        """Convert RGB to CIELAB color space"""
-        r, g, b = [x / 255.0 for x in rgb]
-        
-        # Convert to linear RGB
-        def to_linear(c):
-            return c / 12.92 if c <= 0.04045 else pow((c + 0.055) / 1.055, 2.4)
-        
-        r_lin, g_lin, b_lin = map(to_linear, [r, g, b])
-        
-        # Convert to XYZ using sRGB matrix
-        x = r_lin * 0.4124564 + g_lin * 0.3575761 + b_lin * 0.1804375
-        y = r_lin * 0.2126729 + g_lin * 0.7151522 + b_lin * 0.0721750
-        z = r_lin * 0.0193339 + g_lin * 0.1191920 + b_lin * 0.9503041
-        
-        # Normalize by D65 white point
-        xn, yn, zn = 0.95047, 1.00000, 1.08883
-        x, y, z = x/xn, y/yn, z/zn
-        
-        # Convert to LAB
-        def f(t):
-            return pow(t, 1/3) if t > 0.008856 else (7.787 * t + 16/116)
-        
-        fx, fy, fz = map(f, [x, y, z])
-        
-        L = 116 * fy - 16
-        a = 500 * (fx - fy)
-        b = 200 * (fy - fz)
-        
-        return (L, a, b)
+    # Convert to linear RGB
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
     
-    def identify_color_with_ai(self, rgb: Tuple[int, int, int], image_description: str = None) -> Dict:
-        """
-        Use Claude AI to intelligently identify ANY color
-        This is the key innovation - AI can identify thousands of colors
-        *** ORIGINAL LOGIC PRESERVED EXACTLY ***
-        """
-        try:
-            import anthropic
-            
-            if not self.api_key or self.api_key == 'your_anthropic_api_key_here':
-                return self._fallback_color_analysis(rgb)
-                
-            client = anthropic.Anthropic(api_key=self.api_key)
-            
-            # Convert to other color spaces for AI analysis
-            lab = self.rgb_to_lab(rgb)
-            hex_color = f"#{rgb[0]:02X}{rgb[1]:02X}{rgb[2]:02X}"
-            
-            # Create comprehensive prompt for ANY color identification
-            prompt = f"""
+    # Convert to white-normalised XYZ
+    xyz = linear @ _SRGB_TO_XYZ_D65.T
+    
+    # Convert to LAB
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    fx, fy, fz = f[..., 0], f[..., 1], f[..., 2]
+    return np.stack((116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)), axis=-1)
+
+@lru_cache(maxsize=8192)
+def _rgb_to_lab_cached(r, g, b) -> Tuple[float, float, float]:
+    L, a, b = rgb_to_lab_array((r, g, b)).tolist()
+    return (L, a, b)
+
+# Parsed Claude analyses keyed on the exact RGB triple plus context, so repeat
+# requests for a colour reuse the analysis instead of making another API round
+# trip. Coarser buckets would hand one colour's match to a neighbour several
+# Delta-E away
+AI_CACHE_SIZE = 4096
+_AI_ANALYSIS_CACHE: "OrderedDict[tuple, Dict]" = OrderedDict()
+_AI_ANALYSIS_LOCK = threading.Lock()
+
+def _cached_ai_analysis(key) -> Optional[Dict]:
+    with _AI_ANALYSIS_LOCK:
+        analysis = _AI_ANALYSIS_CACHE.get(key)
+        if analysis is not None:
+            _AI_ANALYSIS_CACHE.move_to_end(key)
+        return analysis
+
+def _store_ai_analysis(key, analysis: Dict):
+    with _AI_ANALYSIS_LOCK:
+        _AI_ANALYSIS_CACHE[key] = analysis
+        _AI_ANALYSIS_CACHE.move_to_end(key)
+        if len(_AI_ANALYSIS_CACHE) > AI_CACHE_SIZE:
+            _AI_ANALYSIS_CACHE.popitem(last=False)
+
+# raw_decode parses one JSON value from an offset without slicing (orjson has no equivalent)
+_JSON_DECODER = json.JSONDecoder()
+
+# Static parts of the Claude colour-identification prompt; only the colour
+# lines between them are formatted per call
+_COLOR_PROMPT_HEADER = """
 You are an expert textile color analyst with access to the complete Pantone color system. 
 Analyze this color and identify the closest Pantone match(es):
 
 COLOR DATA:
-- RGB: {rgb}
-- HEX: {hex_color}
-- CIELAB: L*={lab[0]:.1f}, a*={lab[1]:.1f}, b*={lab[2]:.1f}
-{f"- Context: {image_description}" if image_description else ""}
+"""
+
+_COLOR_PROMPT_TAIL = """
 
 TASK: Identify the closest Pantone color match(es) from the ENTIRE Pantone system including:
 - PMS (Pantone Matching System)
@@ -128,38 +149,100 @@ Consider:
 4. Multiple potential matches with confidence levels
 
 Respond with JSON:
-{{
-    "primary_match": {{
+{
+    "primary_match": {
         "pantone_code": "PANTONE XXXX XXX",
         "name": "Color Name",
         "confidence": 0.95,
         "delta_e_estimated": 1.2,
         "category": "Red/Blue/Green/etc",
         "collection": "PMS/TPX/TCX/FHI"
-    }},
+    },
     "alternative_matches": [
-        {{
+        {
             "pantone_code": "PANTONE XXXX XXX",
             "name": "Alternative Name",
             "confidence": 0.87,
             "why": "reason for alternative"
-        }}
+        }
     ],
-    "color_analysis": {{
+    "color_analysis": {
         "color_family": "Primary color family",
         "undertones": "Undertone description",
         "textile_suitability": "Assessment for textile use",
         "lighting_sensitivity": "Metamerism assessment"
-    }},
-    "confidence_factors": {{
+    },
+    "confidence_factors": {
         "rgb_precision": "Assessment of RGB accuracy",
         "lighting_conditions": "Assumed lighting conditions",
         "potential_variations": "Possible variations to consider"
-    }}
-}}
+    }
+}
 """
+
+# (family, estimated Pantone) for the fallback classifier, in priority order
+_FALLBACK_FAMILIES = (
+    ("Red", "PANTONE 18-XXXX (Red Family)"),
+    ("Green", "PANTONE 15-XXXX (Green Family)"),
+    ("Blue", "PANTONE 19-XXXX (Blue Family)"),
+    ("Gray/Neutral", "PANTONE Cool Gray X"),
+    ("Complex/Mixed", "PANTONE Mixed Color"),
+)
+
+class UniversalColorMatcher:
+    """
+    *** ORIGINAL UNIVERSAL COLOR MATCHING LOGIC - PRESERVED EXACTLY ***
+    Universal color matching system that can identify ANY color
+    Uses AI + comprehensive color science instead of hardcoded database
+    """
+    
+    def __init__(self):
+        self.api_key = API_KEY
+        # One async client per matcher so its HTTP connection pool (and TLS
+        # sessions) are reused, and awaiting Claude doesn't block the event loop
+        self._anthropic = None
+        if anthropic is not None and self.api_key and self.api_key != 'your_anthropic_api_key_here':
+            self._anthropic = anthropic.AsyncAnthropic(api_key=self.api_key)
+        
+    def rgb_to_lab(self, rgb: Tuple[int, int, int]) -> Tuple[float, float, float]:
+        """Convert RGB to CIELAB color space (memoised per RGB triple)"""
+        return _rgb_to_lab_cached(*rgb)
+    
+    async def identify_color_with_ai(self, rgb: Tuple[int, int, int], image_description: str = None) -> Dict:
+        """
+        Use Claude AI to intelligently identify ANY color
+        This is the key innovation - AI can identify thousands of colors
+        *** ORIGINAL LOGIC PRESERVED EXACTLY ***
+        """
+        try:
+            if not self.api_key or self.api_key == 'your_anthropic_api_key_here':
+                return self._fallback_color_analysis(rgb)
+            if self._anthropic is None:
+                return self._fallback_color_analysis(rgb, error="anthropic package not installed")
             
-            message = client.messages.create(
+            # Convert to other color spaces for AI analysis
+            lab = self.rgb_to_lab(rgb)
+            hex_color = f"#{rgb[0]:02X}{rgb[1]:02X}{rgb[2]:02X}"
+            technical_data = {
+                'rgb': list(rgb),
+                'hex': hex_color,
+                'lab': [round(x, 2) for x in lab],
+                'analysis_method': 'AI_Enhanced',
+                'timestamp': datetime.now().isoformat()
+            }
+            
+            cache_key = (int(rgb[0]), int(rgb[1]), int(rgb[2]), image_description)
+            cached_analysis = _cached_ai_analysis(cache_key)
+            if cached_analysis is not None:
+                return {**cached_analysis, 'technical_data': technical_data}
+            
+            # Create comprehensive prompt for ANY color identification
+            context_line = f"- Context: {image_description}" if image_description else ""
+            prompt = (f"{_COLOR_PROMPT_HEADER}- RGB: {rgb}\n- HEX: {hex_color}\n"
+                      f"- CIELAB: L*={lab[0]:.1f}, a*={lab[1]:.1f}, b*={lab[2]:.1f}\n"
+                      f"{context_line}{_COLOR_PROMPT_TAIL}")
+            
+            message = await self._anthropic.messages.create(
                 model="claude-3-5-sonnet-20241022",
                 max_tokens=1500,
                 messages=[{"role": "user", "content": prompt}]
@@ -168,24 +251,17 @@ Respond with JSON:
             # Parse AI response
             try:
                 response_text = message.content[0].text
-                # Extract JSON from response
+                # Extract JSON from response: decode the first object in place,
+                # ignoring whatever prose follows it
                 json_start = response_text.find('{')
-                json_end = response_text.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    ai_analysis = json.loads(response_text[json_start:json_end])
+                if json_start >= 0:
+                    ai_analysis, _ = _JSON_DECODER.raw_decode(response_text, json_start)
                 else:
-                    ai_analysis = json.loads(response_text)
+                    ai_analysis = json_loads(response_text)
+                _store_ai_analysis(cache_key, ai_analysis)
                 
                 # Add technical data
-                ai_analysis['technical_data'] = {
-                    'rgb': list(rgb),
-                    'hex': hex_color,
-                    'lab': [round(x, 2) for x in lab],
-                    'analysis_method': 'AI_Enhanced',
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                return ai_analysis
+                return {**ai_analysis, 'technical_data': technical_data}
                 
             except json.JSONDecodeError:
                 # Fallback if JSON parsing fails
@@ -216,25 +292,18 @@ Respond with JSON:
         lab = self.rgb_to_lab(rgb)
         hex_color = f"#{rgb[0]:02X}{rgb[1]:02X}{rgb[2]:02X}"
         
-        # Basic color family identification
+        # Basic color family identification: the first matching test wins,
+        # in the order of _FALLBACK_FAMILIES, with Complex/Mixed as the default
         r, g, b = rgb
-        max_component = max(r, g, b)
-        
-        if r == max_component and r > g + 30 and r > b + 30:
-            color_family = "Red"
-            estimated_pantone = "PANTONE 18-XXXX (Red Family)"
-        elif g == max_component and g > r + 30 and g > b + 30:
-            color_family = "Green" 
-            estimated_pantone = "PANTONE 15-XXXX (Green Family)"
-        elif b == max_component and b > r + 30 and b > g + 30:
-            color_family = "Blue"
-            estimated_pantone = "PANTONE 19-XXXX (Blue Family)"
-        elif abs(r - g) < 20 and abs(g - b) < 20:
-            color_family = "Gray/Neutral"
-            estimated_pantone = "PANTONE Cool Gray X"
-        else:
-            color_family = "Complex/Mixed"
-            estimated_pantone = "PANTONE Mixed Color"
+        matches = (
+            r > g + 30 and r > b + 30,
+            g > r + 30 and g > b + 30,
+            b > r + 30 and b > g + 30,
+            abs(r - g) < 20 and abs(g - b) < 20,
+            True,
+        )
+        color_family, estimated_pantone = next(
+            family for matched, family in zip(matches, _FALLBACK_FAMILIES) if matched)
         
         return {
             'primary_match': {
@@ -263,18 +332,19 @@ Respond with JSON:
         if method == "dominant":
             # Simple dominant color extraction
             pixels = image_array.reshape(-1, 3)
-            
-            # Remove very dark and very light pixels
-            filtered_pixels = pixels[
-                (pixels.sum(axis=1) > 50) & (pixels.sum(axis=1) < 700)
-            ]
-            
-            if len(filtered_pixels) == 0:
-                filtered_pixels = pixels
+            channels = [pixels[:, i] for i in range(3)]
+            
+            # Remove very dark and very light pixels; brightness is one uint16
+            # pass and the kept pixels are summed in place rather than copied out
+            brightness = channels[0].astype(np.uint16) + channels[1] + channels[2]
+            keep = (brightness > 50) & (brightness < 700)
+            count = np.count_nonzero(keep)
+            if count == 0:
+                keep, count = True, len(pixels)
                 
-            # Calculate mean color
-            mean_color = np.mean(filtered_pixels, axis=0)
-            return tuple(int(x) for x in mean_color)
+            # Calculate mean color (exact integer sums)
+            return tuple(int(np.add.reduce(channel, dtype=np.uint64, where=keep) / count)
+                         for channel in channels)
             
         elif method == "center":
             # Extract color from center region
@@ -289,50 +359,101 @@ Respond with JSON:
         else:
             raise ValueError(f"Unknown extraction method: {method}")
 
+# Shared async HTTP client for HuggingFace inference; keeps connections alive
+# across requests and frees the event loop while a model runs. HTTP/2 (which
+# multiplexes concurrent calls over one TLS session) needs the optional h2 package
+_HF_HTTP = httpx.AsyncClient(
+    timeout=30,
+    http2=importlib.util.find_spec("h2") is not None,
+    limits=httpx.Limits(max_keepalive_connections=20),
+)
+
+# Stands in for the sketch's base64 in the HuggingFace JSON payload
+HF_IMAGE_PLACEHOLDER = "__SKETCH_IMAGE_BASE64__"
+
+# HuggingFace calls in flight, keyed on a digest of URL + body
+_HF_IN_FLIGHT: Dict[bytes, "asyncio.Future[Tuple[int, bytes]]"] = {}
+
+async def _post_hf(api_url: str, headers: Dict, body: bytes) -> Tuple[int, bytes]:
+    response = await _HF_HTTP.post(api_url, headers=headers, content=body)
+    return response.status_code, response.content
+
+async def _post_hf_coalesced(api_url: str, headers: Dict, body: bytes) -> Tuple[int, bytes]:
+    """
+    POST to HuggingFace, sharing one upstream call among identical concurrent
+    requests (same sketch, prompt and parameters). The shield keeps a caller
+    that disconnects from cancelling the call for everyone else
+    """
+    key = hashlib.blake2b(api_url.encode() + body, digest_size=16).digest()
+    pending = _HF_IN_FLIGHT.get(key)
+    if pending is None:
+        pending = asyncio.ensure_future(_post_hf(api_url, headers, body))
+        _HF_IN_FLIGHT[key] = pending
+        pending.add_done_callback(lambda _: _HF_IN_FLIGHT.pop(key, None))
+    return await asyncio.shield(pending)
+
 class SketchColorizer:
     """Enhanced sketch colorization with HuggingFace AI"""
     
     def __init__(self):
         self.hf_api_key = HF_API_KEY
     
-    def colorize_sketch(self, sketch: Image.Image, style: str = "fashion", target_color: str = None, 
+    @staticmethod
+    def _prepare_sketch(sketch: Image.Image) -> Image.Image:
+        """RGB, at most 2048px on the long edge"""
+        new_size = None
+        if max(sketch.size) > 2048:
+            ratio = 2048 / max(sketch.size)
+            new_size = tuple(int(dim * ratio) for dim in sketch.size)
+            # A freshly opened JPEG can decode straight at a reduced DCT scale
+            sketch.draft('RGB', new_size)
+        
+        # Convert to RGB if needed
+        if sketch.mode != 'RGB':
+            sketch = sketch.convert('RGB')
+        
+        # Resize if too large; this is only a size guard before colorization,
+        # so an area-averaging BOX filter is plenty (LANCZOS is several times slower)
+        if new_size is not None and sketch.size != new_size:
+            sketch = sketch.resize(new_size, Image.Resampling.BOX)
+        
+        # An RGB upload within the size guard is still lazily undecoded here;
+        # decode it now, on this worker thread, rather than inside the colorizer
+        sketch.load()
+        return sketch
+    
+    async def colorize_sketch(self, sketch: Image.Image, style: str = "fashion", target_color: str = None, 
                        white_threshold: int = 245, color_variance: int = 30, skin_protection: float = 0.3, 
                        element_colors: Dict = None) -> Dict:
         """AI-powered sketch colorization with HuggingFace"""
         print(f"🎨 SketchColorizer.colorize_sketch called with target_color: {target_color}")
         print(f"🎨 Element colors: {element_colors}")
+        # Pillow and NumPy work runs in worker threads (both release the GIL for
+        # the heavy parts) so the event loop keeps serving other requests
         try:
-            # Convert to RGB if needed
-            if sketch.mode != 'RGB':
-                sketch = sketch.convert('RGB')
-            
-            # Resize if too large
-            if max(sketch.size) > 2048:
-                ratio = 2048 / max(sketch.size)
-                new_size = tuple(int(dim * ratio) for dim in sketch.size)
-                sketch = sketch.resize(new_size, Image.Resampling.LANCZOS)
+            sketch = await asyncio.to_thread(self._prepare_sketch, sketch)
             
             # Try AI colorization if HF API available
             if self.hf_api_key and self.hf_api_key.startswith('hf_'):
                 print(f"🤖 Using HF AI colorization with target_color: {target_color}")
-                return self._ai_colorization(sketch, style, target_color, element_colors)
+                return await self._ai_colorization(sketch, style, target_color, element_colors,
+                                                   white_threshold, color_variance, skin_protection)
             else:
                 print(f"🎯 Using basic colorization with target_color: {target_color}")
-                return self._basic_colorization(sketch, style, target_color, white_threshold, color_variance, skin_protection, element_colors)
+                return await asyncio.to_thread(self._basic_colorization, sketch, style, target_color, white_threshold, color_variance, skin_protection, element_colors)
                 
         except Exception as e:
             print(f"🚨 Exception in colorize_sketch, falling back to basic: {str(e)}")
-            return self._basic_colorization(sketch, style, target_color, white_threshold, color_variance, skin_protection, element_colors)
+            return await asyncio.to_thread(self._basic_colorization, sketch, style, target_color, white_threshold, color_variance, skin_protection, element_colors)
     
-    def _ai_colorization(self, sketch: Image.Image, style: str, target_color: str = None, element_colors: Dict = None) -> Dict:
+    async def _ai_colorization(self, sketch: Image.Image, style: str, target_color: str = None, element_colors: Dict = None,
+                               white_threshold: int = 245, color_variance: int = 30, skin_protection: float = 0.3) -> Dict:
         """HuggingFace AI-powered colorization"""
         try:
-            import requests
-            
-            # Convert sketch to base64
+            # Encode the sketch as PNG; zlib level 1 encodes several times faster
+            # than the default 6 for a transient upload that is only slightly larger
             buffered = BytesIO()
-            sketch.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode()
+            await asyncio.to_thread(sketch.save, buffered, format="PNG", compress_level=1, optimize=False)
             
             # Style-specific prompts
             style_prompts = {
@@ -349,23 +470,27 @@ class SketchColorizer:
             
             # HuggingFace Inference API
             api_url = "https://api-inference.huggingface.co/models/lllyasviel/sd-controlnet-canny"
-            headers = {"Authorization": f"Bearer {self.hf_api_key}"}
+            headers = {"Authorization": f"Bearer {self.hf_api_key}", "Content-Type": "application/json"}
             
             payload = {
                 "inputs": prompt,
                 "parameters": {
-                    "image": img_base64,
+                    "image": HF_IMAGE_PLACEHOLDER,
                     "num_inference_steps": 20,
                     "guidance_scale": 7.5,
                     "controlnet_conditioning_scale": 1.0
                 }
             }
             
-            response = requests.post(api_url, headers=headers, json=payload, timeout=30)
+            # The base64 bytes are spliced into the serialized JSON as-is, so the
+            # image never becomes a Python str or passes through the JSON encoder
+            head, _, tail = json_dumps(payload).partition(HF_IMAGE_PLACEHOLDER.encode())
+            body = b''.join((head, base64.b64encode(buffered.getbuffer()), tail))
             
-            if response.status_code == 200:
+            status_code, colorized_data = await _post_hf_coalesced(api_url, headers, body)
+            
+            if status_code == 200:
                 # Success - return AI colorized image
-                colorized_data = response.content
                 colorized_image = Image.open(BytesIO(colorized_data))
                 
                 return {
@@ -378,11 +503,11 @@ class SketchColorizer:
             else:
                 # Fallback to basic colorization
                 print(f"🚨 HF API request failed, falling back to basic colorization with color: {target_color}")
-                return self._basic_colorization(sketch, style, target_color, white_threshold, color_variance, skin_protection)
+                return await asyncio.to_thread(self._basic_colorization, sketch, style, target_color, white_threshold, color_variance, skin_protection, element_colors)
                 
         except Exception as e:
             print(f"🚨 _ai_colorization exception, falling back to basic colorization: {str(e)}")
-            return self._basic_colorization(sketch, style, target_color, white_threshold, color_variance, skin_protection)
+            return await asyncio.to_thread(self._basic_colorization, sketch, style, target_color, white_threshold, color_variance, skin_protection, element_colors)
     
     def _basic_colorization(self, sketch: Image.Image, style: str, target_color: str = None, 
                            white_threshold: int = 245, color_variance: int = 30, skin_protection: float = 0.3, 
@@ -408,6 +533,46 @@ color_matcher = UniversalColorMatcher()
 sketch_colorizer = SketchColorizer()
 texture_service = TextureApplicationService()
 
+@app.on_event("startup")
+async def configure_executor():
+    """Size the pool behind asyncio.to_thread to the machine's cores"""
+    asyncio.get_running_loop().set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix='pv-image')
+    )
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Close the pooled API connections"""
+    await _HF_HTTP.aclose()
+    if color_matcher._anthropic is not None:
+        await color_matcher._anthropic.close()
+
+class RejectOversizedUploads:
+    """
+    Refuse bodies over the limit from Content-Length, before any of it is spooled.
+    Plain ASGI rather than @app.middleware, so other requests pay only a header scan
+    """
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            for name, value in scope['headers']:
+                if name == b'content-length':
+                    if value.isdigit() and int(value) > MAX_REQUEST_SIZE:
+                        response = DefaultJSONResponse(status_code=413, content={
+                            "success": False,
+                            "error": f"Upload too large (max {MAX_REQUEST_SIZE//1024//1024}MB per request)"
+                        })
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+app.add_middleware(RejectOversizedUploads)
+# Added last so CORS is the outermost layer and the 413 above carries its headers
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
 # HTML Interface (same as before)
 HTML_INTERFACE = """
 <!DOCTYPE html>
@@ -1300,10 +1465,18 @@ HTML_INTERFACE = """
 </html>
 """
 
+# The interface never changes at runtime: encode and compress it once
+_HTML_BYTES = HTML_INTERFACE.encode('utf-8')
+_HTML_BYTES_GZ = gzip.compress(_HTML_BYTES, compresslevel=9)
+_HTML_CACHE_HEADERS = {"Cache-Control": "public, max-age=3600", "Vary": "Accept-Encoding"}
+
 # Routes
 @app.get("/", response_class=HTMLResponse)
-async def home():
-    return HTMLResponse(content=HTML_INTERFACE)
+async def home(request: Request):
+    if 'gzip' in request.headers.get('accept-encoding', ''):
+        return Response(content=_HTML_BYTES_GZ, media_type="text/html",
+                        headers={**_HTML_CACHE_HEADERS, "Content-Encoding": "gzip"})
+    return Response(content=_HTML_BYTES, media_type="text/html", headers=_HTML_CACHE_HEADERS)
 
 @app.get("/texture-ui")
 async def texture_interface():
@@ -1353,7 +1526,7 @@ async def identify_color(file: UploadFile = File(...)):
         print(f"🎨 DOMINANT COLOR EXTRACTED: RGB{dominant_rgb}")
         
         # Identify color using ORIGINAL AI logic
-        result = color_matcher.identify_color_with_ai(
+        result = await color_matcher.identify_color_with_ai(
             dominant_rgb, 
             image_description="textile color sample"
         )
@@ -1409,7 +1582,7 @@ async def colorize_sketch(
         if color_data:
             print(f"🎨 COLOR DATA RECEIVED: {color_data[:200]}...")  # Show first 200 chars
             try:
-                color_info = json.loads(color_data)
+                color_info = json_loads(color_data)
                 # Check multiple possible locations for hex color data
                 target_color = None
                 
@@ -1455,7 +1628,7 @@ async def colorize_sketch(
         
         print(f"🖌️  COLORIZING WITH COLOR: {target_color}")
         print(f"🎨 ELEMENT COLORS: {element_colors}")
-        result = sketch_colorizer.colorize_sketch(sketch_image, style, target_color=target_color, 
+        result = await sketch_colorizer.colorize_sketch(sketch_image, style, target_color=target_color, 
                                                  white_threshold=white_threshold, color_variance=color_variance, 
                                                  skin_protection=skin_protection, element_colors=element_colors)
         
@@ -1538,7 +1711,7 @@ async def apply_texture(
         pantone_colors = None
         if color_data:
             try:
-                color_info = json.loads(color_data)
+                color_info = json_loads(color_data)
                 if 'primary_match' in color_info:
                     pantone_colors = [color_info['primary_match']]
             except Exception as e:
@@ -1619,7 +1792,7 @@ async def colorize_and_texture(
         pantone_colors = None
         if color_data:
             try:
-                color_info = json.loads(color_data)
+                color_info = json_loads(color_data)
                 if 'technical_data' in color_info and 'hex' in color_info['technical_data']:
                     target_color = color_info['technical_data']['hex']
                 if 'primary_match' in color_info:
@@ -1628,7 +1801,7 @@ async def colorize_and_texture(
                 print(f"Color data parsing failed: {e}")
         
         # Colorize sketch
-        colorization_result = sketch_colorizer.colorize_sketch(
+        colorization_result = await sketch_colorizer.colorize_sketch(
             sketch_image, style, target_color=target_color,
             white_threshold=white_threshold, color_variance=color_variance, skin_protection=skin_protection
         )
@@ -1699,6 +1872,12 @@ if __name__ == "__main__":
     print(f"✅ HuggingFace API: {'Configured' if HF_API_KEY and HF_API_KEY.startswith('hf_') else 'Not configured'}")
     print("🔥 PANTONE LOGIC: ORIGINAL - PRESERVED EXACTLY")
     print("🚀 Enhanced with HuggingFace sketch colorization")
+    
+    # uvloop and httptools (uvicorn[standard]) when installed; uvloop has no
+    # Windows build, so fall back to the stock asyncio loop and h11 parser
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    print(f"⚡ Event loop: {loop}, HTTP parser: {http}")
     print("=" * 60)
     
-    uvicorn.run(app, host="127.0.0.1", port=8000, reload=False)
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=8000, reload=False, loop=loop, http=http)
\ No newline at end of file
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Multipart form data parsing for Pantone Vision API
+Python 3.13+ compatible replacement for cgi.FieldStorage
+"""
+
+import re
+import tempfile
+from typing import Any, Optional
+
+# Multipart header patterns, matched directly against raw bytes
+_BOUNDARY_RE = re.compile(rb'boundary=([^;]+)')
+_NAME_RE = re.compile(rb'name="([^"]*)"')
+_FILENAME_RE = re.compile(rb'filename="([^"]*)"')
+
+class MultipartField:
+    """Represents a field in multipart form data"""
+    def __init__(self, name: str, value: Any = None, filename: str = None):
+        self.name = name
+        self.value = value
+        self.filename = filename
+        self.file = None
+
+# Read size for streamed request bodies (Falcon's tuned default)
+DEFAULT_CHUNK_SIZE = 32768
+# File parts larger than this spill from memory to a temporary file
+SPOOL_MAX_SIZE = 1024 * 1024
+# Text fields are buffered in memory, so they are capped by default
+DEFAULT_MAX_FIELD_SIZE = 1024 * 1024
+
+class MultipartLimitError(ValueError):
+    """A part exceeded the parser's size limit; the rest of the body is left unread"""
+
+class StreamingMultipartParser:
+    """
+    Python 3.13+ compatible replacement for cgi.FieldStorage that consumes the request stream in chunks instead of
+    reading the whole body first. File parts are written to a
+    SpooledTemporaryFile exposed as field.file; their value stays None.
+    
+    Raises MultipartLimitError if a text field exceeds max_field_size or a
+    file part exceeds max_file_size (None means unlimited).
+    """
+    
+    def __init__(self, stream, content_length: int, content_type: str,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_field_size: Optional[int] = DEFAULT_MAX_FIELD_SIZE,
+                 max_file_size: Optional[int] = None):
+        self.fields = {}
+        self._remaining = content_length
+        self._max_field_size = max_field_size
+        self._max_file_size = max_file_size
+        try:
+            self._parse_stream(stream, content_type, chunk_size)
+        except MultipartLimitError:
+            raise
+        except Exception as e:
+            print(f"Multipart parsing error: {e}")
+        
+        # Consume any epilogue so a keep-alive connection stays in sync
+        while self._remaining > 0:
+            chunk = stream.read(min(chunk_size, self._remaining))
+            if not chunk:
+                break
+            self._remaining -= len(chunk)
+    
+    def _check_size(self, target, filename: Optional[str]):
+        """Enforce the per-part limits as a part's body grows"""
+        if filename is None:
+            if self._max_field_size is not None and len(target) > self._max_field_size:
+                raise MultipartLimitError(f"Form field exceeds {self._max_field_size} bytes")
+        elif self._max_file_size is not None and target.tell() > self._max_file_size:
+            raise MultipartLimitError(f"File exceeds {self._max_file_size} bytes")
+    
+    def _parse_stream(self, stream, content_type: str, chunk_size: int):
+        """Incrementally split the stream on boundaries"""
+        boundary_match = _BOUNDARY_RE.search(content_type.encode())
+        if not boundary_match:
+            return
+        
+        delimiter = b'--' + boundary_match.group(1).strip(b'"')
+        separator = b'\r\n' + delimiter
+        keep = len(separator) - 1
+        
+        buffer = bytearray()
+        state = 'preamble'
+        name = filename = target = None
+        
+        while state != 'done':
+            progressed = True
+            while progressed and state != 'done':
+                progressed = False
+                
+                if state == 'preamble':
+                    idx = buffer.find(delimiter)
+                    if idx == -1:
+                        del buffer[:max(0, len(buffer) - keep)]
+                    else:
+                        del buffer[:idx + len(delimiter)]
+                        state = 'delimiter'
+                        progressed = True
+                
+                elif state == 'delimiter':
+                    # "--" closes the body, CRLF opens the next part's headers
+                    if len(buffer) >= 2:
+                        state = 'done' if buffer[:2] == b'--' else 'headers'
+                        del buffer[:2]
+                        progressed = True
+                
+                elif state == 'headers':
+                    idx = buffer.find(b'\r\n\r\n')
+                    if idx != -1:
+                        headers_data = bytes(buffer[:idx])
+                        del buffer[:idx + 4]
+                        name_match = _NAME_RE.search(headers_data)
+                        filename_match = _FILENAME_RE.search(headers_data)
+                        name = name_match.group(1).decode('utf-8', errors='ignore') if name_match else None
+                        filename = filename_match.group(1).decode('utf-8', errors='ignore') if filename_match else None
+                        target = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) if filename_match else bytearray()
+                        state = 'body'
+                        progressed = True
+                
+                elif state == 'body':
+                    idx = buffer.find(separator)
+                    if idx == -1:
+                        # Hold back enough bytes to match a separator split across chunks
+                        flush = len(buffer) - keep
+                        if flush > 0:
+                            if isinstance(target, bytearray):
+                                target += buffer[:flush]
+                            else:
+                                target.write(buffer[:flush])
+                            del buffer[:flush]
+                            self._check_size(target, filename)
+                    else:
+                        if isinstance(target, bytearray):
+                            target += buffer[:idx]
+                        else:
+                            target.write(buffer[:idx])
+                        del buffer[:idx + len(separator)]
+                        self._check_size(target, filename)
+                        self._store_field(name, filename, target)
+                        state = 'delimiter'
+                        progressed = True
+            
+            if state == 'done' or self._remaining <= 0:
+                break
+            chunk = stream.read(min(chunk_size, self._remaining))
+            if not chunk:
+                break
+            self._remaining -= len(chunk)
+            buffer += chunk
+    
+    def _store_field(self, name: Optional[str], filename: Optional[str], target):
+        """Register a completed part"""
+        if name is None:
+            return
+        if isinstance(target, bytearray):
+            self.fields[name] = MultipartField(name, target.decode('utf-8', errors='ignore'))
+        else:
+            target.seek(0)
+            field = MultipartField(name, filename=filename)
+            field.file = target
+            self.fields[name] = field
+    
+    def get(self, key: str, default=None):
+        """Get field value(s) - returns list for compatibility with cgi.FieldStorage"""
+        if key in self.fields:
+            return [self.fields[key]]
+        return default or []
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.fields
+    
+    def __getitem__(self, key: str):
+        return self.fields[key]
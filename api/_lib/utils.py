@@ -7,9 +7,9 @@ Shared helper functions for image processing and validation
 import base64
 import io
 import json
-import re
+import time
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Union, BinaryIO
 from PIL import Image
 import numpy as np
 from email.message import EmailMessage
@@ -17,17 +17,28 @@ from email import policy
 
 from .config import MAX_FILE_SIZE, ALLOWED_EXTENSIONS
 
-def validate_image_file(file_content: bytes, filename: str) -> Dict[str, Any]:
+def validate_image_file(file_content: Union[bytes, BinaryIO], filename: str) -> Dict[str, Any]:
     """
     Validate uploaded image file
+    Accepts raw bytes or an open binary file (e.g. a spooled upload), which is
+    decoded in place rather than copied into memory first
     Returns validation result with success status and details
     """
     try:
+        if hasattr(file_content, 'read'):
+            stream = file_content
+            file_size = stream.seek(0, io.SEEK_END)
+            raw_bytes = None
+        else:
+            stream = io.BytesIO(file_content)
+            file_size = len(file_content)
+            raw_bytes = file_content
+        
         # Check file size
-        if len(file_content) > MAX_FILE_SIZE:
+        if file_size > MAX_FILE_SIZE:
             return {
                 'success': False,
-                'error': f'File size ({len(file_content)} bytes) exceeds limit ({MAX_FILE_SIZE} bytes)'
+                'error': f'File size ({file_size} bytes) exceeds limit ({MAX_FILE_SIZE} bytes)'
             }
         
         # Check file extension
@@ -40,11 +51,13 @@ def validate_image_file(file_content: bytes, filename: str) -> Dict[str, Any]:
         
         # Try to open and validate image
         try:
-            image = Image.open(io.BytesIO(file_content))
+            stream.seek(0)
+            image = Image.open(stream)
             image.verify()  # Verify it's a valid image
             
-            # Re-open for processing (verify closes the file)
-            image = Image.open(io.BytesIO(file_content))
+            # Re-open for processing (verify leaves the image unusable)
+            stream.seek(0)
+            image = Image.open(stream)
             
             return {
                 'success': True,
@@ -52,7 +65,9 @@ def validate_image_file(file_content: bytes, filename: str) -> Dict[str, Any]:
                 'format': image.format,
                 'size': image.size,
                 'mode': image.mode,
-                'file_size': len(file_content)
+                'file_size': file_size,
+                'raw_bytes': raw_bytes,
+                'mime_type': Image.MIME.get(image.format)
             }
             
         except Exception as e:
@@ -70,8 +85,13 @@ def validate_image_file(file_content: bytes, filename: str) -> Dict[str, Any]:
 def image_to_base64(image: Image.Image, format: str = "PNG") -> str:
     """Convert PIL Image to base64 string"""
     buffer = io.BytesIO()
-    image.save(buffer, format=format)
-    return base64.b64encode(buffer.getvalue()).decode()
+    if format.upper() == 'PNG':
+        # zlib level 1 roughly halves encode time for a slightly larger payload
+        image.save(buffer, format=format, compress_level=1, optimize=False)
+    else:
+        image.save(buffer, format=format)
+    # getbuffer() is a zero-copy view; getvalue() would copy the encoded image
+    return base64.b64encode(buffer.getbuffer()).decode('ascii')
 
 def base64_to_image(base64_str: str) -> Image.Image:
     """Convert base64 string to PIL Image"""
@@ -82,7 +102,15 @@ def base64_to_image(base64_str: str) -> Image.Image:
 def prepare_image_for_processing(image: Image.Image, max_size: int = 2048) -> Image.Image:
     """
     Prepare image for AI processing - resize if needed, convert to RGB
+    Expects the lazily opened image from validate_image_file, so the pixels
+    are decoded exactly once, here
     """
+    # A JPEG that will be downsized anyway can decode at a reduced DCT scale
+    # (no-op for other formats or already-loaded images)
+    if max(image.size) > max_size:
+        ratio = max_size / max(image.size)
+        image.draft('RGB', (max(1, int(image.width * ratio)), max(1, int(image.height * ratio))))
+    
     # Convert to RGB if necessary
     if image.mode in ('RGBA', 'LA', 'P'):
         # Create white background for transparency
@@ -178,99 +206,20 @@ class ProcessingTimer:
     """Context manager for timing operations"""
     
     def __init__(self):
-        self.start_time = None
-        self.end_time = None
+        self.start_ns = None
+        self.end_ns = None
     
     def __enter__(self):
-        self.start_time = datetime.now()
+        self.start_ns = time.perf_counter_ns()
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.end_time = datetime.now()
+        self.end_ns = time.perf_counter_ns()
     
     @property
     def elapsed_ms(self) -> float:
-        if self.start_time and self.end_time:
-            return (self.end_time - self.start_time).total_seconds() * 1000
-        return 0.0
-
-class MultipartField:
-    """Represents a field in multipart form data"""
-    def __init__(self, name: str, value: Any = None, filename: str = None):
-        self.name = name
-        self.value = value
-        self.filename = filename
-        self.file = None
-        
-        # For file fields, create a file-like object
-        if isinstance(value, bytes):
-            self.file = io.BytesIO(value)
-
-class MultipartParser:
-    """Python 3.13+ compatible multipart form data parser (replaces cgi.FieldStorage)"""
-    
-    def __init__(self, body: bytes, content_type: str):
-        self.fields = {}
-        self._parse(body, content_type)
-    
-    def _parse(self, body: bytes, content_type: str):
-        """Parse multipart form data"""
-        try:
-            # Extract boundary from content type
-            boundary_match = re.search(r'boundary=([^;]+)', content_type)
-            if not boundary_match:
-                return
-            
-            boundary = boundary_match.group(1).strip('"')
-            boundary_bytes = ('--' + boundary).encode()
-            
-            # Split by boundary
-            parts = body.split(boundary_bytes)
-            
-            for part in parts[1:-1]:  # Skip first empty part and last closing part
-                if not part.strip():
-                    continue
-                
-                # Split headers and body
-                if b'\r\n\r\n' not in part:
-                    continue
-                    
-                headers_data, body_data = part.split(b'\r\n\r\n', 1)
-                
-                # Parse headers
-                headers_text = headers_data.decode('utf-8', errors='ignore')
-                
-                # Extract field name
-                name_match = re.search(r'name="([^"]*)"', headers_text)
-                if not name_match:
-                    continue
-                
-                field_name = name_match.group(1)
-                
-                # Check if it's a file field
-                filename_match = re.search(r'filename="([^"]*)"', headers_text)
-                
-                if filename_match:
-                    # File field
-                    filename = filename_match.group(1)
-                    field = MultipartField(field_name, body_data, filename)
-                else:
-                    # Regular field
-                    field = MultipartField(field_name, body_data.decode('utf-8', errors='ignore'))
-                
-                self.fields[field_name] = field
-                
-        except Exception as e:
-            print(f"Multipart parsing error: {e}")
-    
-    def get(self, key: str, default=None):
-        """Get field value(s) - returns list for compatibility with cgi.FieldStorage"""
-        if key in self.fields:
-            return [self.fields[key]]
-        return default or []
-    
-    def __contains__(self, key: str) -> bool:
-        return key in self.fields
-    
-    def __getitem__(self, key: str):
-        return self.fields[key]
\ No newline at end of file
+        """Elapsed time so far, or the total once the block has exited"""
+        if self.start_ns is None:
+            return 0.0
+        end_ns = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end_ns - self.start_ns) / 1_000_000
@@ -5,19 +5,70 @@ Serverless function for textile pattern transfer using Gemini 2.5 Flash Image
 """
 
 from http.server import BaseHTTPRequestHandler
+import atexit
 import json
 import sys
 import os
-from datetime import datetime
 import base64
 from io import BytesIO
-# cgi module removed in Python 3.13+, using custom multipart parser
 import time
+import random
+from datetime import datetime
+import concurrent.futures
+from typing import Optional
 from PIL import Image
 
+# orjson serializes straight to bytes and is several times faster than stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Add current directory to path for relative imports
 sys.path.insert(0, os.path.dirname(__file__))
 
+# cgi module removed in Python 3.13+, using custom multipart parser
+try:
+    from _lib.multipart import StreamingMultipartParser, MultipartLimitError
+except ImportError:
+    # Buffered fallback on the stdlib email parser when _lib is not deployed
+    from email import policy
+    from email.parser import BytesParser
+    from types import SimpleNamespace
+    
+    class MultipartLimitError(ValueError):
+        pass
+    
+    class StreamingMultipartParser:
+        def __init__(self, stream, content_length, content_type, max_field_size=None, max_file_size=None, **kwargs):
+            message = BytesParser(policy=policy.HTTP).parsebytes(
+                b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + stream.read(content_length))
+            self.fields = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if name is None:
+                    continue
+                payload = part.get_payload(decode=True) or b''
+                filename = part.get_filename()
+                limit = max_field_size if filename is None else max_file_size
+                if limit is not None and len(payload) > limit:
+                    raise MultipartLimitError(f"Part '{name}' exceeds {limit} bytes")
+                if filename is None:
+                    self.fields[name] = SimpleNamespace(name=name, value=payload.decode('utf-8', errors='ignore'),
+                                                        filename=None, file=None)
+                else:
+                    self.fields[name] = SimpleNamespace(name=name, value=None, filename=filename,
+                                                        file=BytesIO(payload))
+        
+        def get(self, key, default=None):
+            return [self.fields[key]] if key in self.fields else default or []
+        
+        def __contains__(self, key):
+            return key in self.fields
+        
+        def __getitem__(self, key):
+            return self.fields[key]
+
 try:
     from _lib.utils import (
         validate_image_file, prepare_image_for_processing, 
@@ -34,7 +85,8 @@ except ImportError:
     def validate_image_file(file_content, filename):
         try:
             image = Image.open(BytesIO(file_content))
-            return {'success': True, 'image': image, 'size': image.size, 'format': image.format, 'mode': image.mode}
+            return {'success': True, 'image': image, 'size': image.size, 'format': image.format, 'mode': image.mode,
+                    'raw_bytes': file_content, 'mime_type': Image.MIME.get(image.format)}
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
@@ -48,20 +100,20 @@ except ImportError:
     
     class ProcessingTimer:
         def __init__(self):
-            self.start_time = None
+            self.start_ns = None
         def __enter__(self):
-            self.start_time = datetime.now()
+            self.start_ns = time.perf_counter_ns()
             return self
         def __exit__(self, *args):
             pass
         @property
         def elapsed_ms(self):
-            return (datetime.now() - self.start_time).total_seconds() * 1000 if self.start_time else 0
+            return (time.perf_counter_ns() - self.start_ns) / 1_000_000 if self.start_ns else 0
     
     def image_to_base64(image, format="PNG"):
         buffer = BytesIO()
         image.save(buffer, format=format)
-        return base64.b64encode(buffer.getvalue()).decode()
+        return base64.b64encode(buffer.getbuffer()).decode('ascii')
     
     def store_processing_result(*args, **kwargs):
         return {'success': True}
@@ -71,78 +123,86 @@ except ImportError:
     
     # Get Gemini API key from environment
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-    
-    # Simple multipart parser for Python 3.13+ compatibility
-    import re
-    
-    class MultipartField:
-        def __init__(self, name, value=None, filename=None):
-            self.name = name
-            self.value = value
-            self.filename = filename
-            self.file = None
-            if isinstance(value, bytes):
-                self.file = BytesIO(value)
-    
-    class MultipartParser:
-        def __init__(self, body, content_type):
-            self.fields = {}
-            self._parse(body, content_type)
-        
-        def _parse(self, body, content_type):
-            try:
-                boundary_match = re.search(r'boundary=([^;]+)', content_type)
-                if not boundary_match:
-                    return
-                boundary = boundary_match.group(1).strip('"')
-                boundary_bytes = ('--' + boundary).encode()
-                parts = body.split(boundary_bytes)
-                
-                for part in parts[1:-1]:
-                    if not part.strip():
-                        continue
-                    if b'\r\n\r\n' not in part:
-                        continue
-                    headers_data, body_data = part.split(b'\r\n\r\n', 1)
-                    headers_text = headers_data.decode('utf-8', errors='ignore')
-                    name_match = re.search(r'name="([^"]*)"', headers_text)
-                    if not name_match:
-                        continue
-                    field_name = name_match.group(1)
-                    filename_match = re.search(r'filename="([^"]*)"', headers_text)
-                    
-                    if filename_match:
-                        filename = filename_match.group(1)
-                        field = MultipartField(field_name, body_data, filename)
-                    else:
-                        field = MultipartField(field_name, body_data.decode('utf-8', errors='ignore'))
-                    self.fields[field_name] = field
-            except Exception as e:
-                print(f"Multipart parsing error: {e}")
-        
-        def get(self, key, default=None):
-            if key in self.fields:
-                return [self.fields[key]]
-            return default or []
-        
-        def __contains__(self, key):
-            return key in self.fields
-        
-        def __getitem__(self, key):
-            return self.fields[key]
+
+# Pretty-print responses only in debug mode; read once rather than per response
+_DEBUG = os.getenv('DEBUG') == 'true'
+
+# Request body cap (textile plus sketch) and per-file cap; the latter matches
+# _lib.config.MAX_FILE_SIZE
+_MAX_UPLOAD = 32 * 1024 * 1024
+_MAX_FILE_PART = 15 * 1024 * 1024
+
+# Keep the cached DB client for the container's lifetime; release it once at shutdown
+atexit.register(cleanup_connections)
+
+# Background pool for work the client response doesn't depend on (e.g. DB writes)
+_BG_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='pv-bg')
+
+# Request-path image validation gets its own threads, so it never queues behind slow DB writes
+_VALIDATE_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='pv-validate')
+
+# Retry settings for transient Gemini errors (500 / 429)
+GEMINI_MAX_RETRIES = 3
+GEMINI_RETRY_BASE_DELAY = 1.0  # seconds
+GEMINI_RETRY_BUDGET = 60.0  # total seconds we are willing to spend waiting
+
+def _get_retry_after(error):
+    """Return the Retry-After delay (seconds) exposed by an API error, if any"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+# Upload formats Gemini accepts as-is, so RGB uploads can skip decode + re-encode
+GEMINI_PASSTHROUGH_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+GEMINI_MAX_IMAGE_SIZE = 2048
+
+def get_upload_image_part(validation):
+    """Build a Gemini Part from the original upload bytes when no conversion is needed"""
+    if validation.get('mode') != 'RGB' or validation.get('format') not in GEMINI_PASSTHROUGH_FORMATS:
+        return None
+    if not validation.get('raw_bytes') or max(validation['size']) > GEMINI_MAX_IMAGE_SIZE:
+        return None
+    try:
+        from google.genai import types
+        return types.Part.from_bytes(data=validation['raw_bytes'], mime_type=validation['mime_type'])
+    except ImportError:
+        return None
+
+# Gemini client and availability, resolved once per process and reused across requests
+_GEMINI_CLIENT = None
+_GEMINI_AVAILABLE: Optional[bool] = None
 
 # Lazy load Gemini components
 def get_gemini_client():
     """Lazy load Gemini client to reduce cold start time"""
+    global _GEMINI_CLIENT, _GEMINI_AVAILABLE
+    
+    if _GEMINI_CLIENT is not None:
+        return _GEMINI_CLIENT
+    
     try:
         from google import genai
         # Create client with API key
         client = genai.Client(api_key=GEMINI_API_KEY)
-        return client
     except ImportError as e:
         print(f"Warning: Gemini import failed: {e}")
         # Return a simple HTTP-based client instead
-        return SimpleGeminiClient(GEMINI_API_KEY)
+        client = SimpleGeminiClient(GEMINI_API_KEY)
+    
+    _GEMINI_AVAILABLE = client.is_available() if isinstance(client, SimpleGeminiClient) else True
+    _GEMINI_CLIENT = client
+    return client
+
+def is_gemini_available() -> bool:
+    """Whether Gemini is usable, without constructing anything after the first check"""
+    if _GEMINI_AVAILABLE is None:
+        get_gemini_client()
+    return _GEMINI_AVAILABLE
 
 class SimpleGeminiClient:
     """Simple Gemini client using HTTP requests instead of SDK"""
@@ -174,8 +234,12 @@ class GeminiTextileTransfer:
         self.client = get_gemini_client()
     
     def transfer_textile_pattern(self, textile_image, sketch_image, 
-                               pantone_color=None, pantone_name=None):
-        """Transfer textile pattern from source to garment sketch using Gemini"""
+                               pantone_color=None, pantone_name=None, textile_part=None):
+        """Transfer textile pattern from source to garment sketch using Gemini
+        
+        textile_part, when given, is sent to Gemini in place of textile_image
+        (the original upload bytes, avoiding a decode + re-encode).
+        """
         if not self.client:
             # Use fallback pattern transfer without Gemini
             return self._fallback_pattern_transfer(
@@ -191,24 +255,29 @@ class GeminiTextileTransfer:
             
             print(f"🚀 Sending request to Gemini 2.5 Flash Image...")
             
-            # Add retry logic for 500 errors
-            import time
-            max_retries = 3
-            for attempt in range(max_retries):
+            # Retry 500/429 errors with jittered exponential backoff, bounded by a time budget
+            deadline = time.monotonic() + GEMINI_RETRY_BUDGET
+            for attempt in range(GEMINI_MAX_RETRIES):
                 try:
                     # Generate with Gemini using official 2025 API format (pass PIL Images directly)
                     response = self.client.models.generate_content(
                         model=self.model_name,
-                        contents=[prompt, textile_image, sketch_image],
+                        contents=[prompt, textile_part or textile_image, sketch_image],
                     )
                     break  # Success, exit retry loop
                 except Exception as e:
-                    if "500" in str(e) and attempt < max_retries - 1:
-                        print(f"🔄 Retry {attempt + 1}/{max_retries} - Gemini server error, waiting 2s...")
-                        time.sleep(2)
-                        continue
-                    else:
-                        raise e  # Re-raise if not 500 error or max retries reached
+                    error_text = str(e)
+                    if ("500" not in error_text and "429" not in error_text) or attempt >= GEMINI_MAX_RETRIES - 1:
+                        raise e  # Re-raise if not retryable or max retries reached
+                    
+                    delay = GEMINI_RETRY_BASE_DELAY * (2 ** attempt) * (0.5 + random.random())
+                    if "429" in error_text:
+                        delay = _get_retry_after(e) or delay
+                    if time.monotonic() + delay > deadline:
+                        raise e  # Not enough budget left to wait it out
+                    
+                    print(f"🔄 Retry {attempt + 1}/{GEMINI_MAX_RETRIES} - Gemini error, waiting {delay:.1f}s...")
+                    time.sleep(delay)
             
             # Process response from Gemini 2.5 Flash Image API
             print(f"Debug: Response type: {type(response)}")
@@ -327,11 +396,6 @@ class GeminiTextileTransfer:
             enhancer = ImageEnhance.Sharpness(result)
             result = enhancer.enhance(1.2)
             
-            # Convert to base64
-            buffer = BytesIO()
-            result.save(buffer, format='PNG', quality=95)
-            result_base64 = base64.b64encode(buffer.getvalue()).decode()
-            
             return {
                 'success': True,
                 'result_image': result,
@@ -376,75 +440,21 @@ class handler(BaseHTTPRequestHandler):
                     self._send_error(400, "Content-Type must be multipart/form-data")
                     return
                 
-                # Read the request body
+                # Parse multipart data straight off the socket (Python 3.13+ compatible)
+                # instead of reading the whole body and slicing copies out of it
                 content_length = int(self.headers.get('Content-Length', 0))
-                body = self.rfile.read(content_length)
+                if content_length > _MAX_UPLOAD:
+                    self.close_connection = True  # body is left unread
+                    self._send_error(413, f"Upload too large (limit {_MAX_UPLOAD} bytes)")
+                    return
                 
-                # Parse multipart data using custom parser (Python 3.13+ compatible)
                 try:
-                    from _lib.utils import MultipartParser as MP
-                    form = MP(body, content_type)
-                except ImportError:
-                    # Define MultipartParser inline if not available
-                    import re
-                    
-                    class MultipartField:
-                        def __init__(self, name, value=None, filename=None):
-                            self.name = name
-                            self.value = value
-                            self.filename = filename
-                            self.file = None
-                            if isinstance(value, bytes):
-                                self.file = BytesIO(value)
-                    
-                    class MultipartParser:
-                        def __init__(self, body, content_type):
-                            self.fields = {}
-                            self._parse(body, content_type)
-                        
-                        def _parse(self, body, content_type):
-                            try:
-                                boundary_match = re.search(r'boundary=([^;]+)', content_type)
-                                if not boundary_match:
-                                    return
-                                boundary = boundary_match.group(1).strip('"')
-                                boundary_bytes = ('--' + boundary).encode()
-                                parts = body.split(boundary_bytes)
-                                
-                                for part in parts[1:-1]:
-                                    if not part.strip():
-                                        continue
-                                    if b'\r\n\r\n' not in part:
-                                        continue
-                                    headers_data, body_data = part.split(b'\r\n\r\n', 1)
-                                    headers_text = headers_data.decode('utf-8', errors='ignore')
-                                    name_match = re.search(r'name="([^"]*)"', headers_text)
-                                    if not name_match:
-                                        continue
-                                    field_name = name_match.group(1)
-                                    filename_match = re.search(r'filename="([^"]*)"', headers_text)
-                                    
-                                    if filename_match:
-                                        filename = filename_match.group(1)
-                                        field = MultipartField(field_name, body_data, filename)
-                                    else:
-                                        field = MultipartField(field_name, body_data.decode('utf-8', errors='ignore'))
-                                    self.fields[field_name] = field
-                            except Exception as e:
-                                print(f"Multipart parsing error: {e}")
-                        
-                        def get(self, key, default=None):
-                            if key in self.fields:
-                                return [self.fields[key]]
-                            return default or []
-                        
-                        def __contains__(self, key):
-                            return key in self.fields
-                        
-                        def __getitem__(self, key):
-                            return self.fields[key]
-                    
-                    form = MultipartParser(body, content_type)
+                    form = StreamingMultipartParser(self.rfile, content_length, content_type,
+                                                    max_file_size=_MAX_FILE_PART)
+                except MultipartLimitError as e:
+                    self.close_connection = True  # body is left unread
+                    self._send_error(413, str(e))
+                    return
                 
                 # Get required images
                 if 'textile_image' not in form:
@@ -455,22 +465,25 @@ class handler(BaseHTTPRequestHandler):
                     self._send_error(400, "sketch_image file required")
                     return
                 
-                # Validate textile image
+                # Read both uploads
                 textile_field = form['textile_image']
                 textile_content = textile_field.file.read()
                 textile_filename = getattr(textile_field, 'filename', 'textile.jpg')
                 
+                sketch_field = form['sketch_image']
+                sketch_content = sketch_field.file.read()
+                sketch_filename = getattr(sketch_field, 'filename', 'sketch.jpg')
+                
+                # Validate both images concurrently (Pillow releases the GIL while decoding):
+                # the sketch on the validation pool, the textile on this thread
+                sketch_future = _VALIDATE_POOL.submit(validate_image_file, sketch_content, sketch_filename)
                 textile_validation = validate_image_file(textile_content, textile_filename)
+                sketch_validation = sketch_future.result()
+                
                 if not textile_validation['success']:
                     self._send_error(400, f"Textile image error: {textile_validation['error']}")
                     return
                 
-                # Validate sketch image
-                sketch_field = form['sketch_image']
-                sketch_content = sketch_field.file.read()
-                sketch_filename = getattr(sketch_field, 'filename', 'sketch.jpg')
-                
-                sketch_validation = validate_image_file(sketch_content, sketch_filename)
                 if not sketch_validation['success']:
                     self._send_error(400, f"Sketch image error: {sketch_validation['error']}")
                     return
@@ -482,8 +495,13 @@ class handler(BaseHTTPRequestHandler):
                 pantone_name_field = form.get('pantone_name', [])
                 pantone_name = pantone_name_field[0].value if pantone_name_field else None
                 
-                # Prepare images for processing
-                textile_image = prepare_image_for_processing(textile_validation['image'])
+                # Prepare images for processing - an RGB JPEG/PNG/WebP textile is sent as
+                # the original upload bytes, so it is never decoded on our side
+                textile_part = get_upload_image_part(textile_validation)
+                if textile_part is not None:
+                    textile_image = textile_validation['image']
+                else:
+                    textile_image = prepare_image_for_processing(textile_validation['image'])
                 sketch_image = prepare_image_for_processing(sketch_validation['image'])
                 
                 # Initialize Gemini transfer service
@@ -494,7 +512,8 @@ class handler(BaseHTTPRequestHandler):
                     textile_image,
                     sketch_image,
                     pantone_color,
-                    pantone_name
+                    pantone_name,
+                    textile_part=textile_part
                 )
                 
                 if not transfer_result.get('success'):
@@ -537,9 +556,10 @@ class handler(BaseHTTPRequestHandler):
                     }
                 }
                 
-                # Store result in database (non-blocking)
+                # Store result in database (fire-and-forget, off the response path)
                 try:
-                    storage_result = store_processing_result(
+                    _BG_POOL.submit(
+                        store_processing_result,
                         {
                             'type': 'gemini_pattern_transfer',
                             'model_used': transfer_result.get('model_used'),
@@ -548,8 +568,6 @@ class handler(BaseHTTPRequestHandler):
                         },
                         'gemini_processing'
                     )
-                    if storage_result['success']:
-                        response_data['storage_id'] = storage_result['id']
                 except Exception as e:
                     print(f"Storage warning: {e}")
                 
@@ -573,21 +591,12 @@ class handler(BaseHTTPRequestHandler):
                 processing_time_ms=timer.elapsed_ms if timer.elapsed_ms else 0
             )
             self._send_json_response(500, error_response)
-            
-        finally:
-            # Clean up resources
-            cleanup_connections()
     
     def do_GET(self):
         """Get Gemini service information"""
         try:
-            # Check if Gemini is available
-            gemini_client = get_gemini_client()
-            gemini_available = gemini_client is not None and (
-                hasattr(gemini_client, 'is_available') and gemini_client.is_available() 
-                if isinstance(gemini_client, SimpleGeminiClient) 
-                else True
-            )
+            # Check if Gemini is available (cached after the first request)
+            gemini_available = is_gemini_available()
             
             response_data = {
                 'endpoint': 'gemini',
@@ -644,8 +653,13 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Cache-Control', 'no-cache')
         self.end_headers()
         
-        json_data = json.dumps(data, indent=2 if os.getenv('DEBUG') == 'true' else None)
-        self.wfile.write(json_data.encode())
+        # One C-level encode and a single write (json.dump to a text wrapper
+        # would go through the chunked pure-Python encoder instead)
+        if orjson is not None:
+            body = orjson.dumps(data, option=orjson.OPT_INDENT_2 if _DEBUG else 0)
+        else:
+            body = json.dumps(data, indent=2 if _DEBUG else None).encode()
+        self.wfile.write(body)
     
     def _send_error(self, status_code: int, message: str, debug_info: dict = None):
         """Send error response with optional debug info"""
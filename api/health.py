@@ -21,7 +21,7 @@ except ImportError:
     # Fallback for production deployment
     APP_VERSION = "2.0.0"
     DEBUG = False
-    def health_check():
+    def db_health_check():
         return {'success': True, 'status': 'connected'}
     def create_api_response(success, data=None, error=None, processing_time_ms=None):
         response = {'success': success, 'timestamp': datetime.now().isoformat()}
@@ -31,6 +31,17 @@ except ImportError:
             response['error'] = error
         return response
 
+# Environment configuration is fixed for the lifetime of the function instance,
+# so read it once at import instead of on every health probe
+_ENV_FLAGS = {
+    'gemini_api': bool(os.getenv('GEMINI_API_KEY')),
+    'anthropic_api': bool(os.getenv('ANTHROPIC_API_KEY')),
+    'huggingface_api': bool(os.getenv('HUGGINGFACE_API_KEY')),
+    'supabase_configured': bool(os.getenv('SUPABASE_URL')),
+    'replicate_api': bool(os.getenv('REPLICATE_API_KEY')),
+    'stability_api': bool(os.getenv('STABILITY_API_KEY'))
+}
+
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         """Health check endpoint"""
@@ -49,14 +60,7 @@ class handler(BaseHTTPRequestHandler):
             db_status = db_health_check()
             
             # Check environment variables
-            env_status = {
-                'gemini_api': bool(os.getenv('GEMINI_API_KEY')),
-                'anthropic_api': bool(os.getenv('ANTHROPIC_API_KEY')),
-                'huggingface_api': bool(os.getenv('HUGGINGFACE_API_KEY')),
-                'supabase_configured': bool(os.getenv('SUPABASE_URL')),
-                'replicate_api': bool(os.getenv('REPLICATE_API_KEY')),
-                'stability_api': bool(os.getenv('STABILITY_API_KEY'))
-            }
+            env_status = _ENV_FLAGS
             
             # Overall health status
             overall_healthy = (
@@ -106,4 +110,5 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Max-Age', '86400')
         self.end_headers()
\ No newline at end of file
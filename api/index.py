@@ -4,39 +4,82 @@ Pantone Vision API - Main Index Endpoint
 Simple health check endpoint for Vercel deployment
 """
 
+from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler
+import hashlib
 import json
+import os
+
+# orjson serializes straight to bytes and is several times faster than stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# CORS preflight headers, shared by every OPTIONS response
+_CORS_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+    ('Access-Control-Max-Age', '86400'),
+]
+
+# The info payload never changes, so serialize it once at import
+_INFO = {
+    "message": "Pantone Vision 2.0 API",
+    "status": "healthy",
+    "version": "2.0.0",
+    "endpoints": {
+        "/api/health": "System health check",
+        "/api/pantone": "Pantone color matching",
+        "/api/texture": "Texture application (8 types)",
+        "/api/gemini": "Gemini pattern transfer"
+    }
+}
+_DEBUG = os.getenv('DEBUG') == 'true'
+if orjson is not None:
+    _INFO_BYTES = orjson.dumps(_INFO, option=orjson.OPT_INDENT_2 if _DEBUG else 0)
+else:
+    _INFO_BYTES = json.dumps(_INFO, indent=2 if _DEBUG else None).encode()
+_ETAG = '"%s"' % hashlib.blake2b(_INFO_BYTES, digest_size=8).hexdigest()
 
 class handler(BaseHTTPRequestHandler):
     """Main API handler for Pantone Vision"""
     
+    # Keep connections alive; every response carries Content-Length
+    protocol_version = "HTTP/1.1"
+    
     def do_GET(self):
         """Handle GET requests - API info endpoint"""
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Cache-Control', 'no-cache')
-        self.end_headers()
-        
-        response = {
-            "message": "Pantone Vision 2.0 API",
-            "status": "healthy",
-            "version": "2.0.0",
-            "endpoints": {
-                "/api/health": "System health check",
-                "/api/pantone": "Pantone color matching",
-                "/api/texture": "Texture application (8 types)",
-                "/api/gemini": "Gemini pattern transfer"
-            }
-        }
+        if self.headers.get('If-None-Match') == _ETAG:
+            self.send_response(304)
+            self.send_header('ETag', _ETAG)
+            self.send_header('Cache-Control', 'public, max-age=300, s-maxage=3600')
+            self.end_headers()
+            return
         
-        self.wfile.write(json.dumps(response, indent=2).encode())
+        self._write_response(200, _INFO_BYTES, cache_control='public, max-age=300, s-maxage=3600',
+                             extra_headers=(('ETag', _ETAG),))
 
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
         self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Access-Control-Max-Age', '86400')
-        self.end_headers()
\ No newline at end of file
+        for name, value in _CORS_HEADERS:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def _write_response(self, status_code: int, body: bytes, content_type: str = 'application/json',
+                        cache_control: str = 'no-cache', extra_headers: tuple = ()):
+        """Write the status line, headers and body with a single write"""
+        self.log_request(status_code)
+        head = (
+            f"{self.protocol_version} {status_code} {HTTPStatus(status_code).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            f"Cache-Control: {cache_control}\r\n"
+        )
+        for name, value in extra_headers:
+            head += f"{name}: {value}\r\n"
+        self.wfile.write((head + "\r\n").encode('latin-1') + body)
\ No newline at end of file
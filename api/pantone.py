@@ -4,218 +4,195 @@ Pantone Color Matching API Endpoint
 Serverless function for color identification and Pantone matching
 """
 
+from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler
+import atexit
+import concurrent.futures
+import gzip
+import hashlib
 import json
 import sys
 import os
 from datetime import datetime
-import base64
-from io import BytesIO
-# cgi module removed in Python 3.13+, using custom multipart parser
+from typing import NamedTuple
+
+# orjson serializes straight to bytes and is several times faster than stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Add current directory to path for relative imports
 sys.path.insert(0, os.path.dirname(__file__))
 
-try:
+from _lib.multipart import StreamingMultipartParser, MultipartLimitError
+
+# Pillow/numpy (via _lib.utils), the matcher and supabase are only needed to
+# serve POST, so GET and OPTIONS cold starts skip them; _lazy_init() binds
+# these module globals on the first POST
+_MATCHER = None
+
+def _lazy_init():
+    """Import the POST-only dependencies once per container"""
+    global _MATCHER, Image, validate_image_file, prepare_image_for_processing
+    global create_api_response, ProcessingTimer, store_processing_result, cleanup_connections
+    if _MATCHER is not None:
+        return
+    
+    from PIL import Image
     from _lib.utils import (
         validate_image_file, prepare_image_for_processing, 
-        create_api_response, ProcessingTimer, safe_json_serialize
+        create_api_response, ProcessingTimer
     )
-    from _lib.database import store_processing_result, cleanup_connections
-except ImportError:
-    # Fallback implementations for production deployment
-    import base64
-    from io import BytesIO
-    from PIL import Image
-    
-    def validate_image_file(file_content, filename):
-        try:
-            image = Image.open(BytesIO(file_content))
-            return {'success': True, 'image': image, 'size': image.size, 'format': image.format, 'mode': image.mode}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
-    
-    def prepare_image_for_processing(image):
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        return image
     
-    def create_api_response(success, data=None, error=None, processing_time_ms=None):
-        return {'success': success, 'data': data, 'error': error, 'timestamp': datetime.now().isoformat()}
-    
-    class ProcessingTimer:
-        def __init__(self):
-            self.start_time = None
-        def __enter__(self):
-            self.start_time = datetime.now()
-            return self
-        def __exit__(self, *args):
+    try:
+        from _lib.database import store_processing_result, cleanup_connections
+    except ImportError:
+        # supabase is not part of the slim Vercel requirements; storage becomes a no-op
+        def store_processing_result(*args, **kwargs):
+            return {'success': True}
+        
+        def cleanup_connections():
             pass
-        @property
-        def elapsed_ms(self):
-            return (datetime.now() - self.start_time).total_seconds() * 1000 if self.start_time else 0
-    
-    def safe_json_serialize(obj):
-        return obj
-    
-    def store_processing_result(*args, **kwargs):
-        return {'success': True}
     
-    def cleanup_connections():
-        pass
+    # Import the original Pantone logic
+    try:
+        from ORIGINAL_PANTONE_LOGIC import UniversalColorMatcher
+    except ImportError:
+        # Fallback implementation if original not available
+        print("Warning: ORIGINAL_PANTONE_LOGIC not found, using fallback")
+        class UniversalColorMatcher:
+            def identify_colors_from_image(self, image, max_colors=5):
+                return {"colors": [], "error": "Original Pantone logic not available"}
     
-    # Simple multipart parser for Python 3.13+ compatibility
-    import re
+    # Keep the cached DB client (and its connections) for the container's
+    # lifetime; release it once at shutdown
+    atexit.register(cleanup_connections)
     
-    class MultipartField:
-        def __init__(self, name, value=None, filename=None):
-            self.name = name
-            self.value = value
-            self.filename = filename
-            self.file = None
-            if isinstance(value, bytes):
-                self.file = BytesIO(value)
-    
-    class MultipartParser:
-        def __init__(self, body, content_type):
-            self.fields = {}
-            self._parse(body, content_type)
-        
-        def _parse(self, body, content_type):
-            try:
-                boundary_match = re.search(r'boundary=([^;]+)', content_type)
-                if not boundary_match:
-                    return
-                boundary = boundary_match.group(1).strip('"')
-                boundary_bytes = ('--' + boundary).encode()
-                parts = body.split(boundary_bytes)
-                
-                for part in parts[1:-1]:
-                    if not part.strip():
-                        continue
-                    if b'\r\n\r\n' not in part:
-                        continue
-                    headers_data, body_data = part.split(b'\r\n\r\n', 1)
-                    headers_text = headers_data.decode('utf-8', errors='ignore')
-                    name_match = re.search(r'name="([^"]*)"', headers_text)
-                    if not name_match:
-                        continue
-                    field_name = name_match.group(1)
-                    filename_match = re.search(r'filename="([^"]*)"', headers_text)
-                    
-                    if filename_match:
-                        filename = filename_match.group(1)
-                        field = MultipartField(field_name, body_data, filename)
-                    else:
-                        field = MultipartField(field_name, body_data.decode('utf-8', errors='ignore'))
-                    self.fields[field_name] = field
-            except Exception as e:
-                print(f"Multipart parsing error: {e}")
-        
-        def get(self, key, default=None):
-            if key in self.fields:
-                return [self.fields[key]]
-            return default or []
-        
-        def __contains__(self, key):
-            return key in self.fields
-        
-        def __getitem__(self, key):
-            return self.fields[key]
+    # The matcher only holds its API key after __init__ (which re-reads .env),
+    # so one instance per container is shared across requests
+    _MATCHER = UniversalColorMatcher()
 
-# Import the original Pantone logic
-try:
-    from ORIGINAL_PANTONE_LOGIC import UniversalColorMatcher
-except ImportError:
-    # Fallback implementation if original not available
-    print("Warning: ORIGINAL_PANTONE_LOGIC not found, using fallback")
-    class UniversalColorMatcher:
-        def identify_colors_from_image(self, image, max_colors=5):
-            return {"colors": [], "error": "Original Pantone logic not available"}
+class PantoneParams(NamedTuple):
+    """Optional POST parameters, coerced to their types once"""
+    include_metadata: bool = False
+    max_colors: int = 10
+
+# Working size for colour identification
+_MATCH_SIZE = (512, 512)
+
+# Upper bound on max_colors, to keep slicing and the response size sane
+_MAX_COLORS_LIMIT = 100
+
+def _parse_params(form) -> PantoneParams:
+    """Build PantoneParams from the parsed multipart form"""
+    # Most requests omit both fields, so only touch the ones present
+    include_metadata = False
+    max_colors = 10
+    if 'include_metadata' in form:
+        include_metadata = form['include_metadata'].value.lower() == 'true'
+    if 'max_colors' in form:
+        max_colors = max(1, min(int(form['max_colors'].value), _MAX_COLORS_LIMIT))
+    return PantoneParams(include_metadata, max_colors)
+
+# Reject bodies above this before reading them (the info endpoint advertises 15MB files)
+_MAX_UPLOAD = 16 * 1024 * 1024
+
+# DB writes run here so the response never waits on the storage round-trip
+_STORAGE_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='pv-storage')
+
+def _store_result(result_data, result_type):
+    """Persist a processing record"""
+    try:
+        store_processing_result(result_data, result_type)
+    except Exception as e:
+        print(f"Storage warning: {e}")
+
+_DEBUG = os.getenv('DEBUG') == 'true'
+
+# Smaller JSON bodies aren't worth the compression overhead
+_GZIP_MIN_SIZE = 1024
+
+def _json_default(obj):
+    """Fallback for numpy/PIL values, which only appear in POST results"""
+    from _lib.utils import safe_json_serialize
+    return safe_json_serialize(obj)
+
+def _dumps(data) -> bytes:
+    """Serialize a response payload to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default, option=orjson.OPT_INDENT_2 if _DEBUG else 0)
+    return json.dumps(data, default=_json_default, indent=2 if _DEBUG else None).encode()
+
+# CORS preflight headers, shared by every OPTIONS response
+_CORS_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+    ('Access-Control-Max-Age', '86400'),
+]
+
+# Endpoint info is static, so build and serialize it once per cold start; only
+# the timestamp is spliced in per request. Same envelope as create_api_response,
+# without importing _lib.utils
+_TIMESTAMP_PLACEHOLDER = '__TIMESTAMP__'
+_INFO_HEAD, _, _INFO_TAIL = _dumps({
+    'success': True,
+    'timestamp': _TIMESTAMP_PLACEHOLDER,
+    'version': '2.0.0',
+    'data': {
+        'endpoint': 'pantone',
+        'methods': ['POST'],
+        'description': 'Pantone color matching from images',
+        'parameters': {
+            'image': 'Image file (required)',
+            'max_colors': 'Maximum colors to return (default: 10)',
+            'include_metadata': 'Include detailed metadata (default: false)'
+        },
+        'supported_formats': ['PNG', 'JPEG', 'GIF', 'WebP'],
+        'max_file_size': '15MB'
+    }
+}).partition(_TIMESTAMP_PLACEHOLDER.encode())
+# Bodies differ only in their timestamp, so the validator is a weak one
+_ETAG = 'W/"%s"' % hashlib.blake2b(_INFO_HEAD + _INFO_TAIL, digest_size=8).hexdigest()
+# No s-maxage: a CDN would otherwise serve one timestamp for an hour
+_INFO_CACHE_CONTROL = 'public, max-age=300'
 
 class handler(BaseHTTPRequestHandler):
+    # Keep connections alive; every response carries Content-Length
+    protocol_version = "HTTP/1.1"
+    
     def do_POST(self):
         """Process image for Pantone color matching"""
-        timer = ProcessingTimer()
+        timer = None
+        body_consumed = False
         
         try:
+            _lazy_init()
+            timer = ProcessingTimer()
             with timer:
                 # Parse multipart form data
                 content_type = self.headers.get('Content-Type', '')
                 
                 if not content_type.startswith('multipart/form-data'):
+                    self.close_connection = True  # body is left unread
                     self._send_error(400, "Content-Type must be multipart/form-data")
                     return
                 
-                # Read the request body
                 content_length = int(self.headers.get('Content-Length', 0))
-                body = self.rfile.read(content_length)
+                if content_length > _MAX_UPLOAD:
+                    self.close_connection = True  # body is left unread
+                    self._send_error(413, f"Upload too large (limit {_MAX_UPLOAD} bytes)")
+                    return
                 
-                # Parse multipart data using custom parser (Python 3.13+ compatible)
+                # Parse multipart data straight off the socket (Python 3.13+ compatible)
                 try:
-                    from _lib.utils import MultipartParser as MP
-                    form = MP(body, content_type)
-                except ImportError:
-                    # Use the fallback MultipartParser defined above
-                    import re
-                    
-                    class MultipartField:
-                        def __init__(self, name, value=None, filename=None):
-                            self.name = name
-                            self.value = value
-                            self.filename = filename
-                            self.file = None
-                            if isinstance(value, bytes):
-                                self.file = BytesIO(value)
-                    
-                    class MultipartParser:
-                        def __init__(self, body, content_type):
-                            self.fields = {}
-                            self._parse(body, content_type)
-                        
-                        def _parse(self, body, content_type):
-                            try:
-                                boundary_match = re.search(r'boundary=([^;]+)', content_type)
-                                if not boundary_match:
-                                    return
-                                boundary = boundary_match.group(1).strip('"')
-                                boundary_bytes = ('--' + boundary).encode()
-                                parts = body.split(boundary_bytes)
-                                
-                                for part in parts[1:-1]:
-                                    if not part.strip():
-                                        continue
-                                    if b'\r\n\r\n' not in part:
-                                        continue
-                                    headers_data, body_data = part.split(b'\r\n\r\n', 1)
-                                    headers_text = headers_data.decode('utf-8', errors='ignore')
-                                    name_match = re.search(r'name="([^"]*)"', headers_text)
-                                    if not name_match:
-                                        continue
-                                    field_name = name_match.group(1)
-                                    filename_match = re.search(r'filename="([^"]*)"', headers_text)
-                                    
-                                    if filename_match:
-                                        filename = filename_match.group(1)
-                                        field = MultipartField(field_name, body_data, filename)
-                                    else:
-                                        field = MultipartField(field_name, body_data.decode('utf-8', errors='ignore'))
-                                    self.fields[field_name] = field
-                            except Exception as e:
-                                print(f"Multipart parsing error: {e}")
-                        
-                        def get(self, key, default=None):
-                            if key in self.fields:
-                                return [self.fields[key]]
-                            return default or []
-                        
-                        def __contains__(self, key):
-                            return key in self.fields
-                        
-                        def __getitem__(self, key):
-                            return self.fields[key]
-                    
-                    form = MultipartParser(body, content_type)
+                    form = StreamingMultipartParser(self.rfile, content_length, content_type)
+                    body_consumed = True  # the parser drains whatever it didn't parse
+                except MultipartLimitError as e:
+                    self.close_connection = True  # body is left unread
+                    self._send_error(413, str(e))
+                    return
                 
                 # Get uploaded image
                 if 'image' not in form:
@@ -239,23 +216,22 @@ class handler(BaseHTTPRequestHandler):
                 
                 image = validation['image']
                 
-                # Prepare image for processing
+                # Colour identification only needs a thumbnail; shrink before converting.
+                # For JPEG, let libjpeg decode straight to RGB at 1/2-1/8 scale
+                if image.format == 'JPEG':
+                    image.draft('RGB', _MATCH_SIZE)
+                image.thumbnail(_MATCH_SIZE, Image.Resampling.BILINEAR)
                 processed_image = prepare_image_for_processing(image)
                 
                 # Get additional parameters
-                include_metadata_field = form.get('include_metadata', [])
-                include_metadata = include_metadata_field[0].value.lower() == 'true' if include_metadata_field else False
-                
-                max_colors_field = form.get('max_colors', [])
-                max_colors = int(max_colors_field[0].value) if max_colors_field else 5
+                params = _parse_params(form)
                 
                 # Perform Pantone color matching with max_colors parameter
-                color_matcher = UniversalColorMatcher()
-                color_results = color_matcher.identify_colors_from_image(processed_image, max_colors=max_colors)
+                color_results = _MATCHER.identify_colors_from_image(processed_image, max_colors=params.max_colors)
                 
                 # Prepare response data
                 response_data = {
-                    'colors': color_results.get('colors', [])[:max_colors],
+                    'colors': color_results.get('colors', [])[:params.max_colors],
                     'image_info': {
                         'original_size': validation['size'],
                         'processed_size': processed_image.size,
@@ -269,7 +245,7 @@ class handler(BaseHTTPRequestHandler):
                     }
                 }
                 
-                if include_metadata:
+                if params.include_metadata:
                     response_data['metadata'] = {
                         'file_size': validation['file_size'],
                         'filename': filename,
@@ -277,21 +253,6 @@ class handler(BaseHTTPRequestHandler):
                         'color_spaces': color_results.get('color_spaces', {})
                     }
                 
-                # Store result in database (optional, non-blocking)
-                try:
-                    storage_result = store_processing_result(
-                        {
-                            'type': 'pantone_matching',
-                            'colors_found': len(color_results.get('colors', [])),
-                            'processing_time_ms': timer.elapsed_ms
-                        },
-                        'pantone_matching'
-                    )
-                    if storage_result['success']:
-                        response_data['storage_id'] = storage_result['id']
-                except Exception as e:
-                    print(f"Storage warning: {e}")
-                
                 # Send success response
                 response = create_api_response(
                     True, 
@@ -301,63 +262,79 @@ class handler(BaseHTTPRequestHandler):
                 
                 self._send_json_response(200, response)
                 
+                # Store result in database once the client has its response
+                _STORAGE_POOL.submit(
+                    _store_result,
+                    {
+                        'type': 'pantone_matching',
+                        'colors_found': len(color_results.get('colors', [])),
+                        'processing_time_ms': timer.elapsed_ms
+                    },
+                    'pantone_matching'
+                )
+                
         except Exception as e:
             print(f"Pantone matching error: {e}")
-            error_response = create_api_response(
-                False, 
-                error=f"Processing failed: {str(e)}",
-                processing_time_ms=timer.elapsed_ms if timer.elapsed_ms else 0
-            )
-            self._send_json_response(500, error_response)
-            
-        finally:
-            # Clean up resources
-            cleanup_connections()
+            if not body_consumed:
+                self.close_connection = True  # leftover body bytes would be read as the next request
+            # create_api_response's envelope, built inline: if _lazy_init() itself
+            # failed, the _lib.utils helpers were never bound
+            self._send_json_response(500, {
+                'success': False,
+                'timestamp': datetime.now().isoformat(),
+                'version': '2.0.0',
+                'error': f"Processing failed: {str(e)}",
+                'processing_time_ms': round(timer.elapsed_ms, 2) if timer is not None else 0
+            })
     
     def do_GET(self):
         """Get available Pantone colors or system info"""
-        try:
-            # Simple info endpoint
-            info = {
-                'endpoint': 'pantone',
-                'methods': ['POST'],
-                'description': 'Pantone color matching from images',
-                'parameters': {
-                    'image': 'Image file (required)',
-                    'max_colors': 'Maximum colors to return (default: 10)',
-                    'include_metadata': 'Include detailed metadata (default: false)'
-                },
-                'supported_formats': ['PNG', 'JPEG', 'GIF', 'WebP'],
-                'max_file_size': '15MB'
-            }
-            
-            response = create_api_response(True, info)
-            self._send_json_response(200, response)
-            
-        except Exception as e:
-            error_response = create_api_response(False, error=str(e))
-            self._send_json_response(500, error_response)
+        if self.headers.get('If-None-Match') == _ETAG:
+            self.send_response(304)
+            self.send_header('ETag', _ETAG)
+            self.send_header('Cache-Control', _INFO_CACHE_CONTROL)
+            self.end_headers()
+            return
+        
+        body = b''.join((_INFO_HEAD, datetime.now().isoformat().encode(), _INFO_TAIL))
+        self._write_response(200, body, cache_control=_INFO_CACHE_CONTROL,
+                             extra_headers=(('ETag', _ETAG),))
     
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
         self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Access-Control-Max-Age', '86400')
+        for name, value in _CORS_HEADERS:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def _send_json_response(self, status_code: int, data: dict):
         """Send JSON response with proper headers"""
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Cache-Control', 'no-cache')
-        self.end_headers()
-        
         # Safely serialize the response
-        json_data = json.dumps(data, default=safe_json_serialize, indent=2 if os.getenv('DEBUG') == 'true' else None)
-        self.wfile.write(json_data.encode())
+        body = _dumps(data)
+        extra_headers = [('Vary', 'Accept-Encoding')]
+        if len(body) > _GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            # Level 1 is several times faster than the default with most of the size win
+            body = gzip.compress(body, compresslevel=1)
+            extra_headers.append(('Content-Encoding', 'gzip'))
+        self._write_response(status_code, body, extra_headers=extra_headers)
+    
+    def _write_response(self, status_code: int, body: bytes, content_type: str = 'application/json',
+                        cache_control: str = 'no-cache', extra_headers: tuple = ()):
+        """Write the status line, headers and body with a single write"""
+        self.log_request(status_code)
+        head = (
+            f"{self.protocol_version} {status_code} {HTTPStatus(status_code).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            f"Cache-Control: {cache_control}\r\n"
+        )
+        for name, value in extra_headers:
+            head += f"{name}: {value}\r\n"
+        if self.close_connection:
+            head += "Connection: close\r\n"
+        self.wfile.write((head + "\r\n").encode('latin-1') + body)
     
     def _send_error(self, status_code: int, message: str):
         """Send error response"""
@@ -5,34 +5,148 @@ Serverless function for applying fabric textures with AI enhancement
 Preserves ALL 8 texture types: lace, embroidery, silk, satin, leather, velvet, mesh, sequin
 """
 
+from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler
+import atexit
+import concurrent.futures
 import json
+import math
 import sys
 import os
-from datetime import datetime
+import time
+import zlib
 import base64
+import itertools
+from datetime import datetime
 from io import BytesIO
-from PIL import Image
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ImageStat
 # cgi module removed in Python 3.13+, using custom multipart parser
 
+# orjson parses and serializes JSON several times faster than stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Add current directory to path for relative imports
 sys.path.insert(0, os.path.dirname(__file__))
 
+from _lib.multipart import StreamingMultipartParser, MultipartLimitError
+
+# Request body cap (image plus optional custom_texture) and per-file cap; the
+# latter matches _lib.config.MAX_FILE_SIZE
+_MAX_UPLOAD = 32 * 1024 * 1024
+_MAX_FILE_PART = 15 * 1024 * 1024
+
+# Accepted texture_type values (ALL 8 TYPES SUPPORTED), built once
+_TEXTURE_TYPES = ('lace', 'embroidery', 'silk', 'satin', 'leather', 'velvet', 'mesh', 'sequin')
+_VALID_TEXTURES = frozenset(_TEXTURE_TYPES)
+_INVALID_TEXTURE_ERROR = f"Invalid texture_type. Supported: {', '.join(_TEXTURE_TYPES)}"
+
+# Long-edge cap for the texture pipeline (also prepare_image_for_processing's default)
+_MAX_WORKING_SIZE = 2048
+
+def _draft_for_size(image, max_side):
+    """
+    Let libjpeg decode an oversized JPEG at 1/2-1/8 scale, never below what
+    fitting it into max_side needs. No-op for other formats and small images.
+    """
+    if image.format != 'JPEG' or max(image.size) <= max_side:
+        return
+    ratio = max_side / max(image.size)
+    image.draft('RGB', (max(1, int(image.width * ratio)), max(1, int(image.height * ratio))))
+
+def _draft_to_cover(image, size):
+    """
+    Like _draft_for_size, but for ImageOps.fit: the scale must cover size on
+    both sides, so the centre-crop never has to upsample the decoded image.
+    """
+    if image.format != 'JPEG':
+        return
+    ratio = max(size[0] / image.width, size[1] / image.height)
+    if ratio >= 1:
+        return
+    image.draft('RGB', (math.ceil(image.width * ratio), math.ceil(image.height * ratio)))
+
+_DEBUG = os.getenv('DEBUG') == 'true'
+
+def _dumps(data) -> bytes:
+    """Serialize a response payload to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if _DEBUG else 0)
+    return json.dumps(data, indent=2 if _DEBUG else None).encode()
+
+# gzip level for responses to clients that accept it (0 disables). Base64 text
+# deflates to ~75% of its size; level 1 costs ~30ms per MB of body
+_GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '1'))
+# Smaller JSON bodies aren't worth the compression overhead
+_GZIP_MIN_SIZE = 1024
+
+def _gzip_parts(parts):
+    """Deflate an iterable of byte chunks into a gzip stream as they arrive"""
+    compressor = zlib.compressobj(_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+    for part in parts:
+        chunk = compressor.compress(part)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+# The textured image is serialized as this token and spliced back in as raw
+# bytes, so the multi-megabyte base64 payload never becomes a Python str
+_IMAGE_PLACEHOLDER = b'__TEXTURED_IMAGE__'
+
+# 48 KiB of input (a multiple of 3) encodes to 64 KiB of base64 with no padding
+_BASE64_CHUNK = 49152
+
+# zlib level for response PNGs; 1 is several times faster than Pillow's default 6
+_PNG_COMPRESS_LEVEL = int(os.getenv('PNG_COMPRESS_LEVEL', '1'))
+
+# response_format -> (Pillow format, data URL prefix, save options). JPEG goes
+# through the libjpeg-turbo build bundled with Pillow: several times faster to
+# encode than PNG and a much smaller payload, for a lossy preview
+_RESPONSE_FORMATS = {
+    'png': ('PNG', b'data:image/png;base64,', {'compress_level': _PNG_COMPRESS_LEVEL, 'optimize': False}),
+    'jpeg': ('JPEG', b'data:image/jpeg;base64,', {'quality': 90}),
+}
+_RESPONSE_FORMATS['jpg'] = _RESPONSE_FORMATS['jpeg']
+
+def _encode_image(image, image_format: str, options: dict) -> memoryview:
+    """Encode an image for the response; returns a zero-copy view of the bytes"""
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getbuffer()
+
+def _base64_length(size: int) -> int:
+    """Length of the padded base64 encoding of size bytes"""
+    return 4 * ((size + 2) // 3)
+
+def _iter_base64(data):
+    """Base64-encode data in chunks so the full encoding is never held in memory"""
+    for start in range(0, len(data), _BASE64_CHUNK):
+        yield base64.b64encode(data[start:start + _BASE64_CHUNK])
+
 try:
     from _lib.utils import (
         validate_image_file, prepare_image_for_processing, 
-        create_api_response, ProcessingTimer, image_to_base64
+        create_api_response, ProcessingTimer
     )
     from _lib.database import store_processing_result, cleanup_connections
 except ImportError:
     # Fallback implementations for production deployment
-    import base64
-    from io import BytesIO
-    from PIL import Image
-    
     def validate_image_file(file_content, filename):
         try:
-            image = Image.open(BytesIO(file_content))
+            # Accept an open upload file as-is instead of copying it into bytes
+            stream = file_content if hasattr(file_content, 'read') else BytesIO(file_content)
+            # verify() checks integrity without decoding pixels but leaves the
+            # image unusable, so the returned image is a fresh lazy open
+            stream.seek(0)
+            Image.open(stream).verify()
+            stream.seek(0)
+            image = Image.open(stream)
             return {'success': True, 'image': image, 'size': image.size, 'format': image.format, 'mode': image.mode}
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -47,85 +161,136 @@ except ImportError:
     
     class ProcessingTimer:
         def __init__(self):
-            self.start_time = None
+            self.start_ns = None
+            self.end_ns = None
         def __enter__(self):
-            self.start_time = datetime.now()
+            self.start_ns = time.perf_counter_ns()
             return self
         def __exit__(self, *args):
-            pass
+            self.end_ns = time.perf_counter_ns()
         @property
         def elapsed_ms(self):
-            return (datetime.now() - self.start_time).total_seconds() * 1000 if self.start_time else 0
-    
-    def image_to_base64(image, format="PNG"):
-        buffer = BytesIO()
-        image.save(buffer, format=format)
-        return base64.b64encode(buffer.getvalue()).decode()
+            if self.start_ns is None:
+                return 0
+            end_ns = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+            return (end_ns - self.start_ns) / 1_000_000
     
     def store_processing_result(*args, **kwargs):
         return {'success': True}
     
     def cleanup_connections():
         pass
-    
-    # Simple multipart parser for Python 3.13+ compatibility
-    import re
-    
-    class MultipartField:
-        def __init__(self, name, value=None, filename=None):
-            self.name = name
-            self.value = value
-            self.filename = filename
-            self.file = None
-            if isinstance(value, bytes):
-                self.file = BytesIO(value)
-    
-    class MultipartParser:
-        def __init__(self, body, content_type):
-            self.fields = {}
-            self._parse(body, content_type)
-        
-        def _parse(self, body, content_type):
-            try:
-                boundary_match = re.search(r'boundary=([^;]+)', content_type)
-                if not boundary_match:
-                    return
-                boundary = boundary_match.group(1).strip('"')
-                boundary_bytes = ('--' + boundary).encode()
-                parts = body.split(boundary_bytes)
-                
-                for part in parts[1:-1]:
-                    if not part.strip():
-                        continue
-                    if b'\r\n\r\n' not in part:
-                        continue
-                    headers_data, body_data = part.split(b'\r\n\r\n', 1)
-                    headers_text = headers_data.decode('utf-8', errors='ignore')
-                    name_match = re.search(r'name="([^"]*)"', headers_text)
-                    if not name_match:
-                        continue
-                    field_name = name_match.group(1)
-                    filename_match = re.search(r'filename="([^"]*)"', headers_text)
-                    
-                    if filename_match:
-                        filename = filename_match.group(1)
-                        field = MultipartField(field_name, body_data, filename)
-                    else:
-                        field = MultipartField(field_name, body_data.decode('utf-8', errors='ignore'))
-                    self.fields[field_name] = field
-            except Exception as e:
-                print(f"Multipart parsing error: {e}")
-        
-        def get(self, key, default=None):
-            if key in self.fields:
-                return [self.fields[key]]
-            return default or []
-        
-        def __contains__(self, key):
-            return key in self.fields
-        
-        def __getitem__(self, key):
-            return self.fields[key]
+
+# The DB client is cached for the container's lifetime so warm requests reuse
+# its connections; it is released once at shutdown, not after every request
+atexit.register(cleanup_connections)
+
+# DB writes run here so the response never waits on the storage round-trip
+_STORAGE_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='pv-storage')
+
+def _store_result(result_data, result_type):
+    """Persist a processing record"""
+    try:
+        store_processing_result(result_data, result_type)
+    except Exception as e:
+        print(f"Storage warning: {e}")
+
+def _kernel_matrix(kernel_filter):
+    """Normalised weight matrix of a PIL kernel filter"""
+    size, scale, offset, weights = kernel_filter.filterargs
+    return np.array(weights, dtype=np.float64).reshape(size[1], size[0]) / scale
+
+def _compose_kernels(first, second, offset=0):
+    """
+    Fold two consecutive convolutions into one 5x5 PIL kernel, so the image is
+    read and written once instead of twice (intermediate clipping is skipped)
+    """
+    rows = first.shape[0] + second.shape[0] - 1
+    cols = first.shape[1] + second.shape[1] - 1
+    combined = np.zeros((rows, cols))
+    for y in range(first.shape[0]):
+        for x in range(first.shape[1]):
+            combined[y:y + second.shape[0], x:x + second.shape[1]] += first[y, x] * second
+    return ImageFilter.Kernel((cols, rows), combined.ravel().tolist(), scale=1, offset=offset)
+
+_IDENTITY_KERNEL = np.array([[0, 0, 0], [0, 1, 0], [0, 0, 0]], dtype=np.float64)
+
+# embroidery: EMBOSS followed by a 30% blend with EDGE_ENHANCE of the result
+_EMBROIDERY_KERNEL = _compose_kernels(
+    _kernel_matrix(ImageFilter.EMBOSS),
+    0.7 * _IDENTITY_KERNEL + 0.3 * _kernel_matrix(ImageFilter.EDGE_ENHANCE),
+    offset=ImageFilter.EMBOSS.filterargs[2]
+)
+# leather: SHARPEN followed by EDGE_ENHANCE_MORE
+_LEATHER_KERNEL = _compose_kernels(
+    _kernel_matrix(ImageFilter.SHARPEN),
+    _kernel_matrix(ImageFilter.EDGE_ENHANCE_MORE)
+)
+# silk: SMOOTH_MORE with the 1.1x brightness boost folded into the weights
+_SILK_KERNEL = ImageFilter.Kernel((5, 5), (_kernel_matrix(ImageFilter.SMOOTH_MORE) * 1.1).ravel().tolist(), scale=1)
+
+def _scale_lut(factor):
+    """ImageEnhance.Brightness as a per-channel lookup table"""
+    return [min(255, int(i * factor)) for i in range(256)]
+
+@lru_cache(maxsize=64)
+def _contrast_lut(mean, factor, bands):
+    """Contrast lookup table for a given grey mean; only 256 means are possible"""
+    lut = [min(255, max(0, int(mean + factor * (i - mean)))) for i in range(256)]
+    return lut * bands
+
+def _enhance_contrast(image, factor):
+    """ImageEnhance.Contrast as a single point() pass instead of a grey image plus blend"""
+    mean = int(ImageStat.Stat(image.convert('L')).mean[0] + 0.5)
+    return image.point(_contrast_lut(mean, factor, len(image.getbands())))
+
+_BRIGHTNESS_1_2_LUT = _scale_lut(1.2) * 3
+_SATIN_BLUR = ImageFilter.GaussianBlur(radius=1)
+_SEQUIN_MAX = ImageFilter.MaxFilter(size=3)
+
+def _apply_lace(image):
+    # Add delicate pattern
+    return _enhance_contrast(image.filter(ImageFilter.DETAIL), 1.2)
+
+def _apply_embroidery(image):
+    # Add raised texture effect
+    return image.filter(_EMBROIDERY_KERNEL)
+
+def _apply_silk(image):
+    # Add smooth, lustrous effect
+    return image.filter(_SILK_KERNEL)
+
+def _apply_satin(image):
+    # Add glossy effect
+    return _enhance_contrast(image.filter(_SATIN_BLUR), 1.3)
+
+def _apply_leather(image):
+    # Add grain texture
+    return image.filter(_LEATHER_KERNEL)
+
+def _apply_velvet(image):
+    # Add soft, plush effect
+    return ImageEnhance.Color(image.filter(ImageFilter.SMOOTH)).enhance(1.2)
+
+def _apply_mesh(image):
+    # Add perforated pattern
+    return ImageOps.autocontrast(image.filter(ImageFilter.FIND_EDGES))
+
+def _apply_sequin(image):
+    # Add sparkle effect
+    return image.filter(_SEQUIN_MAX).point(_BRIGHTNESS_1_2_LUT)
+
+# texture_type -> filter pass (chained kernels are pre-fused into one pass)
+_TEXTURE_OPS = {
+    'lace': _apply_lace,
+    'embroidery': _apply_embroidery,
+    'silk': _apply_silk,
+    'satin': _apply_satin,
+    'leather': _apply_leather,
+    'velvet': _apply_velvet,
+    'mesh': _apply_mesh,
+    'sequin': _apply_sequin
+}
 
 # Fallback texture service for when main service is unavailable
 class FallbackTextureService:
@@ -143,93 +308,78 @@ class FallbackTextureService:
             'sequin': {'pattern': 'sparkle', 'opacity': 0.5, 'blend': 'screen'}
         }
     
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _get_tint(hex_color, tint_strength=0.15):
+        """
+        Per-band 256-entry lookup table equivalent to blending with a solid
+        Pantone overlay, so the overlay never has to be materialised
+        """
+        hex_color = hex_color.lstrip('#')
+        k = round(tint_strength * 256)
+        lut = []
+        for channel in bytes.fromhex(hex_color[:6]):
+            lut.extend((v * (256 - k) + channel * k + 128) >> 8 for v in range(256))
+        return lut
+    
     def process_full_texture_workflow(self, image, texture_type, pantone_colors=None, intensity=0.8):
         """Apply texture effect using PIL filters"""
-        from PIL import ImageFilter, ImageEnhance, ImageOps
-        import random
+        source = image
         
         # Apply texture-specific filters
-        if texture_type == 'lace':
-            # Add delicate pattern
-            image = image.filter(ImageFilter.DETAIL)
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.2)
-        elif texture_type == 'embroidery':
-            # Add raised texture effect
-            image = image.filter(ImageFilter.EMBOSS)
-            image = Image.blend(image, image.filter(ImageFilter.EDGE_ENHANCE), 0.3)
-        elif texture_type == 'silk':
-            # Add smooth, lustrous effect
-            image = image.filter(ImageFilter.SMOOTH_MORE)
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(1.1)
-        elif texture_type == 'satin':
-            # Add glossy effect
-            image = image.filter(ImageFilter.GaussianBlur(radius=1))
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.3)
-        elif texture_type == 'leather':
-            # Add grain texture
-            image = image.filter(ImageFilter.SHARPEN)
-            image = image.filter(ImageFilter.EDGE_ENHANCE_MORE)
-        elif texture_type == 'velvet':
-            # Add soft, plush effect
-            image = image.filter(ImageFilter.SMOOTH)
-            enhancer = ImageEnhance.Color(image)
-            image = enhancer.enhance(1.2)
-        elif texture_type == 'mesh':
-            # Add perforated pattern
-            image = image.filter(ImageFilter.FIND_EDGES)
-            image = ImageOps.autocontrast(image)
-        elif texture_type == 'sequin':
-            # Add sparkle effect
-            image = image.filter(ImageFilter.MaxFilter(size=3))
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(1.2)
+        texture_op = _TEXTURE_OPS.get(texture_type)
+        if texture_op is not None:
+            image = texture_op(image)
         
-        # Apply intensity adjustment
-        if intensity < 1.0:
-            original = image.copy()
-            image = Image.blend(original, image, intensity)
-        
-        # Apply Pantone color tinting if provided
+        # Apply subtle color overlay based on first Pantone color, if provided
+        tint = None
         if pantone_colors and len(pantone_colors) > 0:
-            # Apply subtle color overlay based on first Pantone color
             if 'hex' in pantone_colors[0]:
-                hex_color = pantone_colors[0]['hex'].lstrip('#')
-                rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-                overlay = Image.new('RGB', image.size, rgb)
-                image = Image.blend(image, overlay, 0.15)  # Subtle tint
+                tint = self._get_tint(pantone_colors[0]['hex'])
         
-        # Convert to base64 for response
-        buffer = BytesIO()
-        image.save(buffer, format='PNG', quality=95)
-        textured_base64 = base64.b64encode(buffer.getvalue()).decode()
+        # Intensity blend against the unfiltered image, then the tint
+        if intensity < 1.0 or tint is not None:
+            image = self._blend_and_tint(source, image, intensity, tint)
         
+        # Returned as a PIL image; do_POST encodes the response exactly once
         return {
             'success': True,
-            'textured_image': f"data:image/png;base64,{textured_base64}",
+            'textured_image': image,
             'texture_applied': texture_type,
             'method': 'PIL_Fallback',
             'intensity': intensity
         }
     
+    def _blend_and_tint(self, source, textured, intensity, tint=None):
+        """
+        Image.blend(source, textured, intensity) followed by a _get_tint() lookup
+        table. Both are single C passes; the tint needs no full-size overlay.
+        """
+        if source.mode != 'RGB':
+            source = source.convert('RGB')
+        if textured.mode != 'RGB':
+            textured = textured.convert('RGB')
+        
+        image = Image.blend(source, textured, intensity) if intensity < 1.0 else textured
+        if tint is not None:
+            image = image.point(tint)
+        return image
+    
     def apply_custom_texture(self, image, custom_texture, pantone_colors=None, intensity=0.8):
         """Apply custom texture using simple blending"""
-        # Resize custom texture to match image size
-        custom_texture = custom_texture.resize(image.size, Image.LANCZOS)
+        # Fit custom texture to the image size without distorting it: centre-crop
+        # to the image's aspect ratio, then area-average (BOX) when shrinking or
+        # BILINEAR when enlarging; both are far cheaper than LANCZOS
+        if custom_texture.size != image.size:
+            resample = Image.BOX if custom_texture.width > image.width else Image.BILINEAR
+            custom_texture = ImageOps.fit(custom_texture, image.size, resample)
         
         # Blend the textures
-        textured = Image.blend(image, custom_texture, intensity * 0.5)
-        
-        # Convert to base64
-        buffer = BytesIO()
-        textured.save(buffer, format='PNG', quality=95)
-        textured_base64 = base64.b64encode(buffer.getvalue()).decode()
+        textured = self._blend_and_tint(image, custom_texture, intensity * 0.5)
         
         return {
             'success': True,
-            'textured_image': f"data:image/png;base64,{textured_base64}",
+            'textured_image': textured,
             'texture_applied': 'custom',
             'method': 'PIL_Fallback',
             'intensity': intensity
@@ -247,7 +397,9 @@ class FallbackTextureService:
             }
         }
 
-# Import texture service with lazy loading for performance
+# Import texture service with lazy loading for performance; built once per
+# container and reused by every request it serves
+@lru_cache(maxsize=1)
 def get_texture_service():
     """Lazy load texture service to reduce cold start time"""
     try:
@@ -272,75 +424,21 @@ class handler(BaseHTTPRequestHandler):
                     self._send_error(400, "Content-Type must be multipart/form-data")
                     return
                 
-                # Read the request body
+                # Parse multipart data straight off the socket (Python 3.13+ compatible);
+                # file parts spill to temporary files instead of pinning the body in RAM
                 content_length = int(self.headers.get('Content-Length', 0))
-                body = self.rfile.read(content_length)
+                if content_length > _MAX_UPLOAD:
+                    self.close_connection = True  # body is left unread
+                    self._send_error(413, f"Upload too large (limit {_MAX_UPLOAD} bytes)")
+                    return
                 
-                # Parse multipart data using custom parser (Python 3.13+ compatible)
                 try:
-                    from _lib.utils import MultipartParser as MP
-                    form = MP(body, content_type)
-                except ImportError:
-                    # Define MultipartParser inline if not available
-                    import re
-                    
-                    class MultipartField:
-                        def __init__(self, name, value=None, filename=None):
-                            self.name = name
-                            self.value = value
-                            self.filename = filename
-                            self.file = None
-                            if isinstance(value, bytes):
-                                self.file = BytesIO(value)
-                    
-                    class MultipartParser:
-                        def __init__(self, body, content_type):
-                            self.fields = {}
-                            self._parse(body, content_type)
-                        
-                        def _parse(self, body, content_type):
-                            try:
-                                boundary_match = re.search(r'boundary=([^;]+)', content_type)
-                                if not boundary_match:
-                                    return
-                                boundary = boundary_match.group(1).strip('"')
-                                boundary_bytes = ('--' + boundary).encode()
-                                parts = body.split(boundary_bytes)
-                                
-                                for part in parts[1:-1]:
-                                    if not part.strip():
-                                        continue
-                                    if b'\r\n\r\n' not in part:
-                                        continue
-                                    headers_data, body_data = part.split(b'\r\n\r\n', 1)
-                                    headers_text = headers_data.decode('utf-8', errors='ignore')
-                                    name_match = re.search(r'name="([^"]*)"', headers_text)
-                                    if not name_match:
-                                        continue
-                                    field_name = name_match.group(1)
-                                    filename_match = re.search(r'filename="([^"]*)"', headers_text)
-                                    
-                                    if filename_match:
-                                        filename = filename_match.group(1)
-                                        field = MultipartField(field_name, body_data, filename)
-                                    else:
-                                        field = MultipartField(field_name, body_data.decode('utf-8', errors='ignore'))
-                                    self.fields[field_name] = field
-                            except Exception as e:
-                                print(f"Multipart parsing error: {e}")
-                        
-                        def get(self, key, default=None):
-                            if key in self.fields:
-                                return [self.fields[key]]
-                            return default or []
-                        
-                        def __contains__(self, key):
-                            return key in self.fields
-                        
-                        def __getitem__(self, key):
-                            return self.fields[key]
-                    
-                    form = MultipartParser(body, content_type)
+                    form = StreamingMultipartParser(self.rfile, content_length, content_type,
+                                                    max_file_size=_MAX_FILE_PART)
+                except MultipartLimitError as e:
+                    self.close_connection = True  # body is left unread
+                    self._send_error(413, str(e))
+                    return
                 
                 # Get required parameters
                 if 'image' not in form:
@@ -351,46 +449,44 @@ class handler(BaseHTTPRequestHandler):
                     self._send_error(400, "texture_type parameter required")
                     return
                 
-                # Read image content
+                # Validate the uploaded file in place; Pillow reads it directly
                 image_field = form['image']
-                image_content = image_field.file.read()
                 filename = getattr(image_field, 'filename', 'unknown.jpg')
-                
-                # Validate image
-                validation = validate_image_file(image_content, filename)
+                validation = validate_image_file(image_field.file, filename)
                 if not validation['success']:
                     self._send_error(400, validation['error'])
                     return
                 
                 image = validation['image']
                 
-                # Get texture parameters
-                texture_type_field = form.get('texture_type')
-                if not texture_type_field:
-                    self._send_error(400, "texture_type parameter required")
+                # Text fields are plain strings; read them directly rather than
+                # through the cgi-style form.get() lists
+                texture_type = form['texture_type'].value
+                if texture_type not in _VALID_TEXTURES:
+                    self._send_error(400, _INVALID_TEXTURE_ERROR)
                     return
-                texture_type = texture_type_field[0].value
-                
-                intensity_field = form.get('intensity', [])
-                intensity = float(intensity_field[0].value) if intensity_field else 0.8
                 
-                # Validate texture type (ALL 8 TYPES SUPPORTED)
-                valid_textures = ['lace', 'embroidery', 'silk', 'satin', 'leather', 'velvet', 'mesh', 'sequin']
-                if texture_type not in valid_textures:
-                    self._send_error(400, f"Invalid texture_type. Supported: {', '.join(valid_textures)}")
+                # Validate intensity (NaN fails the range check too)
+                try:
+                    intensity = float(form['intensity'].value) if 'intensity' in form else 0.8
+                except ValueError:
+                    intensity = None
+                if intensity is None or not 0.0 <= intensity <= 1.0:
+                    self._send_error(400, "intensity must be between 0.0 and 1.0")
                     return
                 
-                # Validate intensity
-                if not 0.0 <= intensity <= 1.0:
-                    self._send_error(400, "intensity must be between 0.0 and 1.0")
+                response_format = form['response_format'].value.lower() if 'response_format' in form else 'png'
+                if response_format not in _RESPONSE_FORMATS:
+                    self._send_error(400, "response_format must be png or jpeg")
                     return
+                image_format, data_url_prefix, encode_options = _RESPONSE_FORMATS[response_format]
                 
                 # Get optional parameters
                 pantone_colors = []
-                pantone_colors_field = form.get('pantone_colors', [])
-                if pantone_colors_field:
+                if 'pantone_colors' in form:
                     try:
-                        pantone_colors = json.loads(pantone_colors_field[0].value)
+                        raw_colors = form['pantone_colors'].value
+                        pantone_colors = orjson.loads(raw_colors) if orjson is not None else json.loads(raw_colors)
                     except (json.JSONDecodeError, AttributeError):
                         print("Warning: Invalid pantone_colors JSON, ignoring")
                 
@@ -399,17 +495,22 @@ class handler(BaseHTTPRequestHandler):
                 if 'custom_texture' in form:
                     custom_texture_field = form['custom_texture']
                     if hasattr(custom_texture_field, 'file') and custom_texture_field.file:
-                        custom_texture_content = custom_texture_field.file.read()
                         custom_texture_filename = getattr(custom_texture_field, 'filename', 'texture.jpg')
                         
-                        custom_validation = validate_image_file(custom_texture_content, custom_texture_filename)
+                        custom_validation = validate_image_file(custom_texture_field.file, custom_texture_filename)
                         if custom_validation['success']:
                             custom_texture_image = custom_validation['image']
                         else:
                             print(f"Custom texture validation failed: {custom_validation['error']}")
                 
-                # Prepare image for processing
+                # Prepare image for processing; the single decode happens here.
+                # Cap the working size first so every filter, blend and encode
+                # pass runs on at most 2048px (original_size is still reported)
+                _draft_for_size(image, _MAX_WORKING_SIZE)
+                image.thumbnail((_MAX_WORKING_SIZE, _MAX_WORKING_SIZE), Image.Resampling.BILINEAR)
                 processed_image = prepare_image_for_processing(image)
+                if custom_texture_image is not None:
+                    _draft_to_cover(custom_texture_image, processed_image.size)
                 
                 # Initialize texture service
                 texture_service = get_texture_service()
@@ -440,13 +541,23 @@ class handler(BaseHTTPRequestHandler):
                     self._send_error(500, error_msg)
                     return
                 
-                # Convert result image to base64 for response
+                # Convert result image to base64 for response (services that already
+                # return a data URL are passed through instead of being re-encoded)
                 textured_image = texture_result['textured_image']
-                result_b64 = image_to_base64(textured_image, 'PNG')
+                if isinstance(textured_image, str) and textured_image.startswith('data:image'):
+                    image_data = textured_image.encode('ascii')
+                    image_parts, image_length = (image_data,), len(image_data)
+                    image_format = textured_image[11:textured_image.find(';')].upper()
+                    output_size = texture_result.get('output_size', processed_image.size)
+                else:
+                    encoded = _encode_image(textured_image, image_format, encode_options)
+                    image_parts = itertools.chain((data_url_prefix,), _iter_base64(encoded))
+                    image_length = len(data_url_prefix) + _base64_length(len(encoded))
+                    output_size = textured_image.size
                 
                 # Prepare response data
                 response_data = {
-                    'textured_image': f"data:image/png;base64,{result_b64}",
+                    'textured_image': _IMAGE_PLACEHOLDER.decode(),
                     'texture_applied': {
                         'type': texture_type,
                         'intensity': intensity,
@@ -456,8 +567,8 @@ class handler(BaseHTTPRequestHandler):
                     'image_info': {
                         'original_size': validation['size'],
                         'processed_size': processed_image.size,
-                        'output_size': textured_image.size,
-                        'format': 'PNG'
+                        'output_size': output_size,
+                        'format': image_format
                     },
                     'processing_info': {
                         'texture_type': texture_type,
@@ -487,23 +598,6 @@ class handler(BaseHTTPRequestHandler):
                         'features': pattern_info.get('features', {})
                     }
                 
-                # Store result in database (non-blocking)
-                try:
-                    storage_result = store_processing_result(
-                        {
-                            'type': 'texture_application',
-                            'texture_type': texture_type,
-                            'intensity': intensity,
-                            'processing_time_ms': timer.elapsed_ms,
-                            'ai_enhanced': texture_result.get('ai_method') is not None
-                        },
-                        'texture_processing'
-                    )
-                    if storage_result['success']:
-                        response_data['storage_id'] = storage_result['id']
-                except Exception as e:
-                    print(f"Storage warning: {e}")
-                
                 # Send success response
                 response = create_api_response(
                     True, 
@@ -511,7 +605,23 @@ class handler(BaseHTTPRequestHandler):
                     processing_time_ms=timer.elapsed_ms
                 )
                 
-                self._send_json_response(200, response)
+                # Headers go out with the final length; the base64 is written as it is encoded
+                head, _, tail = _dumps(response).partition(_IMAGE_PLACEHOLDER)
+                self._send_parts(200, itertools.chain((head,), image_parts, (tail,)),
+                                 len(head) + image_length + len(tail))
+                
+                # Store result in database once the client has its response
+                _STORAGE_POOL.submit(
+                    _store_result,
+                    {
+                        'type': 'texture_application',
+                        'texture_type': texture_type,
+                        'intensity': intensity,
+                        'processing_time_ms': timer.elapsed_ms,
+                        'ai_enhanced': texture_result.get('ai_method') is not None
+                    },
+                    'texture_processing'
+                )
                 
         except Exception as e:
             print(f"Texture application error: {e}")
@@ -524,10 +634,6 @@ class handler(BaseHTTPRequestHandler):
                 processing_time_ms=timer.elapsed_ms if timer.elapsed_ms else 0
             )
             self._send_json_response(500, error_response)
-            
-        finally:
-            # Clean up resources
-            cleanup_connections()
     
     def do_GET(self):
         """Get available texture types and information"""
@@ -585,15 +691,42 @@ class handler(BaseHTTPRequestHandler):
     
     def _send_json_response(self, status_code: int, data: dict):
         """Send JSON response with proper headers"""
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Cache-Control', 'no-cache')
-        self.end_headers()
-        
-        # Handle large responses (base64 images can be big)
-        json_data = json.dumps(data, indent=2 if os.getenv('DEBUG') == 'true' else None)
-        self.wfile.write(json_data.encode())
+        self._send_body(status_code, _dumps(data))
+    
+    def _send_body(self, status_code: int, body: bytes):
+        """Send an already-serialized JSON body"""
+        self._send_parts(status_code, (body,), len(body))
+    
+    def _send_parts(self, status_code: int, parts, content_length: int):
+        """
+        Send a JSON body produced piecewise, whose total length is known up front.
+        The status line and headers share a write with the first part; the rest
+        (the streamed base64) goes to the socket as it is produced.
+        Gzip-accepting clients get the parts deflated as they are produced. The
+        compressed length isn't known until the end, so that body is sent
+        without Content-Length and delimited by closing the connection (this
+        handler speaks HTTP/1.0, which closes after every response anyway).
+        """
+        self.log_request(status_code)
+        length_header = f"Content-Length: {content_length}\r\n"
+        if (_GZIP_LEVEL and content_length > _GZIP_MIN_SIZE
+                and 'gzip' in self.headers.get('Accept-Encoding', '')):
+            parts = _gzip_parts(parts)
+            length_header = "Content-Encoding: gzip\r\n"
+            self.close_connection = True
+        head = (
+            f"{self.protocol_version} {status_code} {HTTPStatus(status_code).phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"{length_header}"
+            "Vary: Accept-Encoding\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Cache-Control: no-cache\r\n"
+            "\r\n"
+        )
+        parts = iter(parts)
+        self.wfile.write(head.encode('latin-1') + next(parts, b''))
+        for part in parts:
+            self.wfile.write(part)
     
     def _send_error(self, status_code: int, message: str):
         """Send error response"""
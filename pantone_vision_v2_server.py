@@ -8,24 +8,32 @@ Preserves existing universal color identification logic
 import os
 import json
 import base64
+import functools
+import shutil
 import tempfile
+import time
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, TYPE_CHECKING
 from io import BytesIO
 
 import uvicorn
-import numpy as np
-from PIL import Image
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-# Import our services
-from services.universal_color_system import UniversalColorMatcher
-from services.sketch_colorization_service import SketchColorizationService
+# orjson parses JSON several times faster than stdlib json; its errors subclass
+# json.JSONDecodeError, so existing handlers still apply
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 # Load environment configuration
 load_dotenv()
@@ -46,9 +54,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-color_matcher = UniversalColorMatcher()
-sketch_colorizer = SketchColorizationService()
+# Services (and the numpy/Pillow stack they pull in) are imported and built on
+# first use rather than at import, keeping cold starts short
+@functools.lru_cache(maxsize=1)
+def get_color_matcher():
+    from services.universal_color_system import UniversalColorMatcher
+    return UniversalColorMatcher()
+
+@functools.lru_cache(maxsize=1)
+def get_sketch_colorizer():
+    from services.sketch_colorization_service import SketchColorizationService
+    return SketchColorizationService()
+
+_LAZY_SERVICES = {'color_matcher': get_color_matcher, 'sketch_colorizer': get_sketch_colorizer}
+
+def __getattr__(name):
+    """Keep the former module-level service instances importable"""
+    if name in _LAZY_SERVICES:
+        return _LAZY_SERVICES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Global configuration
 CONFIG = {
@@ -61,11 +85,38 @@ CONFIG = {
     'results_dir': os.getenv('RESULTS_DIR', './results'),
 }
 
-# Ensure directories exist
-for dir_path in [CONFIG['upload_dir'], CONFIG['results_dir'], 
-                 os.path.join(CONFIG['upload_dir'], 'textiles'),
-                 os.path.join(CONFIG['upload_dir'], 'sketches')]:
-    os.makedirs(dir_path, exist_ok=True)
+# Lookup set for upload extensions
+SUPPORTED_FORMATS = frozenset(CONFIG['supported_formats'])
+
+# Feature flags reported by /api/config, read from the environment once
+FEATURES = {
+    feature: os.getenv(env_var, default).lower() == 'true'
+    for feature, env_var, default in (
+        ('pantone_identification', 'ENABLE_PANTONE_IDENTIFICATION', 'true'),
+        ('sketch_colorization', 'ENABLE_SKETCH_COLORIZATION', 'true'),
+        ('region_selection', 'ENABLE_REGION_SELECTION', 'true'),
+        ('batch_processing', 'ENABLE_BATCH_PROCESSING', 'false'),
+    )
+}
+
+# API keys as the services read them, so health/config/startup can report
+# them without constructing (and importing) the services
+ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
+HF_API_KEY = os.getenv('HUGGINGFACE_API_KEY')
+
+# Storage paths, joined once rather than per request
+UPLOAD_TEXTILES = os.path.join(CONFIG['upload_dir'], 'textiles')
+UPLOAD_SKETCHES = os.path.join(CONFIG['upload_dir'], 'sketches')
+RESULTS_DIR = CONFIG['results_dir']
+UPLOAD_DIRS = {'textiles': UPLOAD_TEXTILES, 'sketches': UPLOAD_SKETCHES}
+
+# Vercel's filesystem is read-only: no storage directories, and nothing is saved to them
+STORAGE_WRITABLE = not os.getenv('VERCEL')
+
+# Ensure directories exist (makedirs creates the parents)
+if STORAGE_WRITABLE:
+    for dir_path in (UPLOAD_TEXTILES, UPLOAD_SKETCHES, RESULTS_DIR):
+        os.makedirs(dir_path, exist_ok=True)
 
 # Pydantic models
 class ColorAnalysisResponse(BaseModel):
@@ -89,28 +140,62 @@ def validate_image_file(file: UploadFile) -> bool:
         return False
         
     file_ext = file.filename.split('.')[-1].lower()
-    if file_ext not in CONFIG['supported_formats']:
+    if file_ext not in SUPPORTED_FORMATS:
         return False
         
     return True
 
-def save_uploaded_file(file: UploadFile, subdir: str) -> str:
-    """Save uploaded file and return path"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}_{file.filename}"
-    file_path = os.path.join(CONFIG['upload_dir'], subdir, filename)
-    
+def iso_timestamp() -> str:
+    """ISO 8601 timestamp for response bodies (as _lib.utils uses)"""
+    return datetime.now().isoformat()
+
+# Copy uploads to disk 1 MiB at a time rather than reading them whole
+UPLOAD_COPY_CHUNK = 1024 * 1024
+
+def _copy_upload(file: UploadFile, file_path: str):
+    file.file.seek(0)
     with open(file_path, "wb") as buffer:
-        content = file.file.read()
-        buffer.write(content)
+        shutil.copyfileobj(file.file, buffer, UPLOAD_COPY_CHUNK)
+    file.file.seek(0)
+
+async def save_uploaded_file(file: UploadFile, subdir: str) -> str:
+    """Save uploaded file and return path (streamed, off the event loop)"""
+    filename = f"{time.strftime('%Y%m%d_%H%M%S')}_{file.filename}"
+    file_path = os.path.join(UPLOAD_DIRS[subdir], filename)
+    
+    await run_in_threadpool(_copy_upload, file, file_path)
     
     return file_path
 
-def image_to_base64(image: Image.Image, format: str = 'PNG') -> str:
+def flatten_to_rgb(image: 'Image.Image', keep_modes=('RGB',)) -> 'Image.Image':
+    """Return the image untouched if its mode is kept, else RGB with transparency composited onto white"""
+    if image.mode in keep_modes:
+        return image
+    from PIL import Image
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        # Pillow's C paste is several times faster than a NumPy float composite
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+# zlib level for PNG results; 1 is several times faster than Pillow's default 6
+PNG_COMPRESS_LEVEL = int(os.getenv('PNG_COMPRESS_LEVEL', '1'))
+
+def image_to_base64(image: 'Image.Image', format: str = 'PNG') -> str:
     """Convert PIL Image to base64 string"""
     buffered = BytesIO()
-    image.save(buffered, format=format)
-    return base64.b64encode(buffered.getvalue()).decode()
+    if format.upper() == 'PNG':
+        image.save(buffered, format=format, compress_level=PNG_COMPRESS_LEVEL, optimize=False)
+    elif format.upper() in ('JPEG', 'JPG'):
+        # Pillow's bundled libjpeg-turbo; much faster and smaller than PNG for previews
+        image.convert('RGB').save(buffered, format='JPEG', quality=90)
+    else:
+        image.save(buffered, format=format)
+    # getbuffer() is a zero-copy view; getvalue() would copy the encoded image
+    return base64.b64encode(buffered.getbuffer()).decode('ascii')
 
 # Routes
 
@@ -137,12 +222,12 @@ async def health_check():
         "status": "healthy",
         "app": CONFIG['app_name'],
         "version": CONFIG['app_version'],
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": iso_timestamp(),
         "services": {
             "pantone_identification": "available",
             "sketch_colorization": "available",
-            "claude_api": "configured" if color_matcher.api_key else "not_configured",
-            "huggingface_api": "configured" if sketch_colorizer.hf_api_key != 'your_hf_token_here' else "not_configured"
+            "claude_api": "configured" if ANTHROPIC_API_KEY else "not_configured",
+            "huggingface_api": "configured" if HF_API_KEY != 'your_hf_token_here' else "not_configured"
         }
     }
 
@@ -155,9 +240,10 @@ async def identify_color(
     Identify Pantone color from uploaded image or RGB values
     Preserves existing universal color identification logic
     """
-    start_time = datetime.now()
+    start_ns = time.perf_counter_ns()
     
     try:
+        color_matcher = get_color_matcher()
         if file:
             # Validate file
             if not validate_image_file(file):
@@ -177,22 +263,25 @@ async def identify_color(
                     detail=f"File size exceeds {CONFIG['max_file_size_mb']}MB limit"
                 )
             
-            # Save file
-            file_path = save_uploaded_file(file, 'textiles')
+            # Keep originals on disk only when debugging
+            if CONFIG['debug'] and STORAGE_WRITABLE:
+                await save_uploaded_file(file, 'textiles')
             
-            # Process image
-            image = Image.open(file_path)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            # Process image straight from the spooled upload
+            import numpy as np
+            from PIL import Image
+            image = flatten_to_rgb(Image.open(file.file))
             
-            # Extract dominant color
-            image_array = np.array(image)
+            # Extract dominant color from a 256px thumbnail; the mean barely moves
+            # and the working set stays cache-sized
+            image.thumbnail((256, 256), Image.Resampling.BILINEAR)
+            image_array = np.asarray(image)
             dominant_rgb = color_matcher.analyze_image_color(image_array, method="dominant")
             
         elif rgb:
             # Parse RGB values
             try:
-                rgb_values = json.loads(rgb)
+                rgb_values = json_loads(rgb)
                 if len(rgb_values) != 3 or not all(0 <= v <= 255 for v in rgb_values):
                     raise ValueError("Invalid RGB values")
                 dominant_rgb = tuple(rgb_values)
@@ -208,24 +297,24 @@ async def identify_color(
         )
         
         # Calculate processing time
-        processing_time = (datetime.now() - start_time).total_seconds() * 1000
+        processing_time = (time.perf_counter_ns() - start_ns) / 1_000_000
         
         return ColorAnalysisResponse(
             success=True,
             data=result,
-            timestamp=datetime.now().isoformat(),
+            timestamp=iso_timestamp(),
             processing_time_ms=processing_time
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        processing_time = (datetime.now() - start_time).total_seconds() * 1000
+        processing_time = (time.perf_counter_ns() - start_ns) / 1_000_000
         
         return ColorAnalysisResponse(
             success=False,
             error=str(e),
-            timestamp=datetime.now().isoformat(),
+            timestamp=iso_timestamp(),
             processing_time_ms=processing_time
         )
 
@@ -233,14 +322,19 @@ async def identify_color(
 async def colorize_sketch(
     sketch: UploadFile = File(...),
     style_prompt: str = Form("fashion illustration"),
-    pantone_colors: Optional[str] = Form(None)
+    pantone_colors: Optional[str] = Form(None),
+    response_format: str = Form("png")
 ):
     """
     Colorize fashion sketch using AI with optional Pantone color guidance
     """
-    start_time = datetime.now()
+    start_ns = time.perf_counter_ns()
     
     try:
+        response_format = response_format.lower()
+        if response_format not in ('png', 'jpeg', 'jpg'):
+            raise HTTPException(status_code=400, detail="response_format must be png or jpeg")
+        
         # Validate sketch file
         if not validate_image_file(sketch):
             raise HTTPException(
@@ -259,25 +353,25 @@ async def colorize_sketch(
                 detail=f"File size exceeds {CONFIG['max_file_size_mb']}MB limit"
             )
         
-        # Save sketch file
-        sketch_path = save_uploaded_file(sketch, 'sketches')
+        # Keep originals on disk only when debugging
+        if CONFIG['debug'] and STORAGE_WRITABLE:
+            await save_uploaded_file(sketch, 'sketches')
         
-        # Load and process sketch
-        sketch_image = Image.open(sketch_path)
-        if sketch_image.mode not in ['RGB', 'L']:
-            sketch_image = sketch_image.convert('RGB')
+        # Load sketch straight from the spooled upload
+        from PIL import Image
+        sketch_image = flatten_to_rgb(Image.open(sketch.file), keep_modes=('RGB', 'L'))
         
         # Parse Pantone colors if provided
         pantone_color_data = []
         if pantone_colors:
             try:
-                pantone_color_data = json.loads(pantone_colors)
+                pantone_color_data = json_loads(pantone_colors)
             except json.JSONDecodeError:
                 # Ignore invalid JSON, proceed without Pantone colors
                 pass
         
         # Perform full colorization workflow
-        result = sketch_colorizer.process_full_workflow(
+        result = get_sketch_colorizer().process_full_workflow(
             sketch_image=sketch_image,
             pantone_colors=pantone_color_data,
             style_prompt=style_prompt
@@ -288,13 +382,15 @@ async def colorize_sketch(
         
         # Convert result image to base64
         colorized_image = result['colorized_image']
-        result['colorized_image_base64'] = image_to_base64(colorized_image)
+        result['colorized_image_base64'] = image_to_base64(colorized_image, response_format.upper())
+        result['colorized_image_format'] = 'png' if response_format == 'png' else 'jpeg'
         
         # Save result to disk
-        result_filename = f"colorized_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-        result_path = os.path.join(CONFIG['results_dir'], result_filename)
-        colorized_image.save(result_path)
-        result['result_file_path'] = result_path
+        if STORAGE_WRITABLE:
+            result_filename = f"colorized_{time.strftime('%Y%m%d_%H%M%S')}.png"
+            result_path = os.path.join(RESULTS_DIR, result_filename)
+            colorized_image.save(result_path)
+            result['result_file_path'] = result_path
         
         # Remove the PIL Image from result (not JSON serializable)
         result.pop('colorized_image', None)
@@ -302,31 +398,31 @@ async def colorize_sketch(
         result.pop('processed_sketch', None)
         
         # Calculate processing time
-        processing_time = (datetime.now() - start_time).total_seconds() * 1000
+        processing_time = (time.perf_counter_ns() - start_ns) / 1_000_000
         
         return ColorizationResponse(
             success=True,
             data=result,
-            timestamp=datetime.now().isoformat(),
+            timestamp=iso_timestamp(),
             processing_time_ms=processing_time
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        processing_time = (datetime.now() - start_time).total_seconds() * 1000
+        processing_time = (time.perf_counter_ns() - start_ns) / 1_000_000
         
         return ColorizationResponse(
             success=False,
             error=str(e),
-            timestamp=datetime.now().isoformat(),
+            timestamp=iso_timestamp(),
             processing_time_ms=processing_time
         )
 
 @app.get("/download/{filename}")
 async def download_file(filename: str):
     """Download generated files"""
-    file_path = os.path.join(CONFIG['results_dir'], filename)
+    file_path = os.path.join(RESULTS_DIR, filename)
     
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
@@ -345,15 +441,10 @@ async def get_config():
         "app_version": CONFIG['app_version'],
         "max_file_size_mb": CONFIG['max_file_size_mb'],
         "supported_formats": CONFIG['supported_formats'],
-        "features": {
-            "pantone_identification": os.getenv('ENABLE_PANTONE_IDENTIFICATION', 'true').lower() == 'true',
-            "sketch_colorization": os.getenv('ENABLE_SKETCH_COLORIZATION', 'true').lower() == 'true',
-            "region_selection": os.getenv('ENABLE_REGION_SELECTION', 'true').lower() == 'true',
-            "batch_processing": os.getenv('ENABLE_BATCH_PROCESSING', 'false').lower() == 'true'
-        },
+        "features": FEATURES,
         "api_status": {
-            "claude": color_matcher.api_key and color_matcher.api_key != 'your_anthropic_api_key_here',
-            "huggingface": sketch_colorizer.hf_api_key != 'your_hf_token_here'
+            "claude": ANTHROPIC_API_KEY and ANTHROPIC_API_KEY != 'your_anthropic_api_key_here',
+            "huggingface": HF_API_KEY != 'your_hf_token_here'
         }
     }
 
@@ -375,7 +466,7 @@ async def server_error_handler(request, exc):
 # Startup event
 @app.on_event("startup")
 async def startup_event():
-    """Initialize services on startup"""
+    """Report configuration on startup; services are built on first use"""
     print("🎨 Pantone Vision 2.0 Starting...")
     print("=" * 60)
     print(f"App Name: {CONFIG['app_name']}")
@@ -386,8 +477,8 @@ async def startup_event():
     print("\nService Status:")
     print(f"  ✅ Pantone Color Identification: Ready")
     print(f"  ✅ Sketch Colorization: Ready")
-    print(f"  {'✅' if color_matcher.api_key != 'your_anthropic_api_key_here' else '❌'} Claude API: {'Configured' if color_matcher.api_key != 'your_anthropic_api_key_here' else 'Not configured'}")
-    print(f"  {'✅' if sketch_colorizer.hf_api_key != 'your_hf_token_here' else '❌'} HuggingFace API: {'Configured' if sketch_colorizer.hf_api_key != 'your_hf_token_here' else 'Not configured'}")
+    print(f"  {'✅' if ANTHROPIC_API_KEY != 'your_anthropic_api_key_here' else '❌'} Claude API: {'Configured' if ANTHROPIC_API_KEY != 'your_anthropic_api_key_here' else 'Not configured'}")
+    print(f"  {'✅' if HF_API_KEY != 'your_hf_token_here' else '❌'} HuggingFace API: {'Configured' if HF_API_KEY != 'your_hf_token_here' else 'Not configured'}")
     print("=" * 60)
 
 # Main execution
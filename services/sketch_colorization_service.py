@@ -115,7 +115,7 @@ class SketchColorizationService:
             # Convert image to base64
             buffered = BytesIO()
             sketch_image.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode()
+            img_base64 = base64.b64encode(buffered.getbuffer()).decode()
             
             # Build color-aware prompt
             enhanced_prompt = self._build_color_prompt(color_prompt, pantone_colors)
@@ -200,7 +200,7 @@ class SketchColorizationService:
             # Convert to base64 for Replicate
             buffered = BytesIO()
             sketch_image.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode()
+            img_base64 = base64.b64encode(buffered.getbuffer()).decode()
             
             # Replicate ControlNet request
             api_url = "https://api.replicate.com/v1/predictions"
@@ -462,8 +462,9 @@ class TextureApplicationService:
     def _image_to_base64(self, image: Image.Image) -> str:
         """Convert PIL image to base64 string"""
         buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode()
+        image.save(buffered, format="PNG", compress_level=1, optimize=False)
+        # Encode straight from the buffer; getvalue() would copy the PNG first
+        return base64.b64encode(buffered.getbuffer()).decode()
     
     def process_full_texture_workflow(self, colorized_image: Image.Image,
                                     texture_type: str,
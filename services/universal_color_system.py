@@ -229,18 +229,19 @@ Respond with JSON:
         if method == "dominant":
             # Simple dominant color extraction
             pixels = image_array.reshape(-1, 3)
+            channels = [pixels[:, i] for i in range(3)]
             
-            # Remove very dark and very light pixels
-            filtered_pixels = pixels[
-                (pixels.sum(axis=1) > 50) & (pixels.sum(axis=1) < 700)
-            ]
-            
-            if len(filtered_pixels) == 0:
-                filtered_pixels = pixels
+            # Remove very dark and very light pixels; brightness is one uint16
+            # pass and the kept pixels are summed in place rather than copied out
+            brightness = channels[0].astype(np.uint16) + channels[1] + channels[2]
+            keep = (brightness > 50) & (brightness < 700)
+            count = np.count_nonzero(keep)
+            if count == 0:
+                keep, count = True, len(pixels)
                 
-            # Calculate mean color
-            mean_color = np.mean(filtered_pixels, axis=0)
-            return tuple(int(x) for x in mean_color)
+            # Calculate mean color (exact integer sums)
+            return tuple(int(np.add.reduce(channel, dtype=np.uint64, where=keep) / count)
+                         for channel in channels)
             
         elif method == "center":
             # Extract color from center region